@@ -2,13 +2,17 @@
 import argparse
 import csv
 import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 from tqdm import tqdm
 import os
 
-def convert_csv_to_tsv(input_file, output_file):
+# Block size for the fast path (bytes read per iteration)
+BLOCK_SIZE = 16 * 1024 * 1024
+
+def convert_csv_to_tsv_csv(input_file, output_file):
     """
-    Convert a CSV file to a TSV file.
+    Convert a CSV file to a TSV file by parsing every row with the csv module.
     
     Args:
         input_file (str): Path to the input CSV file
@@ -22,25 +26,105 @@ def convert_csv_to_tsv(input_file, output_file):
         for row in csv_reader:
             tsv_writer.writerow(row)
 
-def process_input(input_path, output_dir):
+def convert_csv_to_tsv_fast(input_file, output_file, block_size=BLOCK_SIZE):
+    """
+    Convert a CSV file to a TSV file by rewriting delimiters on large byte blocks.
+    
+    Only valid for files without quote characters or tabs; the output matches
+    convert_csv_to_tsv_csv byte for byte (csv.writer terminates lines with CRLF).
+    
+    Args:
+        input_file (str): Path to the input CSV file
+        output_file (str): Path to the output TSV file
+        block_size (int): Number of bytes processed per block
+    
+    Returns:
+        bool: False if a quote or tab was found and the file needs the csv parser
+    """
+    table = bytes.maketrans(b',', b'\t')
+    with open(input_file, 'rb') as csvfile, open(output_file, 'wb') as tsvfile:
+        carry = b''
+        last = b''
+        while True:
+            block = csvfile.read(block_size)
+            if not block:
+                break
+            if b'"' in block or b'\t' in block:
+                return False
+            block = carry + block
+            # Keep a trailing \r for the next block so \r\n is never split
+            carry = b'\r' if block.endswith(b'\r') else b''
+            if carry:
+                block = block[:-1]
+            block = block.replace(b'\r\n', b'\n').replace(b'\r', b'\n').replace(b'\n', b'\r\n')
+            tsvfile.write(block.translate(table))
+            last = block[-1:] or last
+        if carry:
+            tsvfile.write(b'\r\n')
+        elif last and last != b'\n':
+            tsvfile.write(b'\r\n')
+    return True
+
+def convert_csv_to_tsv(input_file, output_file, fast=True):
+    """
+    Convert a CSV file to a TSV file.
+    
+    Args:
+        input_file (str): Path to the input CSV file
+        output_file (str): Path to the output TSV file
+        fast (bool): Try the block-based fast path before falling back to csv parsing
+    
+    Returns:
+        tuple: (input_file, output_file, input size in bytes)
+    """
+    if not (fast and convert_csv_to_tsv_fast(input_file, output_file)):
+        convert_csv_to_tsv_csv(input_file, output_file)
+    return input_file, output_file, os.path.getsize(input_file)
+
+def convert_files_parallel(csv_files, output_dir, jobs, fast=True):
+    """
+    Convert several CSV files concurrently in a process pool.
+    
+    Args:
+        csv_files (list): List of input CSV paths
+        output_dir (Path): Path to output directory
+        jobs (int): Number of worker processes
+        fast (bool): Use the block-based fast path where possible
+    """
+    total_bytes = sum(file.stat().st_size for file in csv_files)
+    with ProcessPoolExecutor(max_workers=jobs) as executor, \
+         tqdm(total=total_bytes, unit='B', unit_scale=True, desc="Converting files") as pbar:
+        futures = [executor.submit(convert_csv_to_tsv, str(file), str(output_dir / (file.stem + '.tsv')), fast)
+                   for file in csv_files]
+        for future in as_completed(futures):
+            input_file, output_file, size = future.result()
+            pbar.update(size)
+            logging.info(f"Converted {input_file} to {output_file}")
+
+def process_input(input_path, output_dir, jobs=1, fast=True):
     """
     Process input files or directory and convert CSV to TSV.
     
     Args:
         input_path (Path): Path to input file or directory
         output_dir (Path): Path to output directory
+        jobs (int): Number of worker processes for directory input
+        fast (bool): Use the block-based fast path where possible
     """
     if input_path.is_file():
         if input_path.suffix.lower() == '.csv':
             output_file = output_dir / (input_path.stem + '.tsv')
-            convert_csv_to_tsv(str(input_path), str(output_file))
+            convert_csv_to_tsv(str(input_path), str(output_file), fast)
             logging.info(f"Converted {input_path} to {output_file}")
     elif input_path.is_dir():
         csv_files = list(input_path.glob('*.csv'))
-        for file in tqdm(csv_files, desc="Converting files"):
-            output_file = output_dir / (file.stem + '.tsv')
-            convert_csv_to_tsv(str(file), str(output_file))
-            logging.info(f"Converted {file} to {output_file}")
+        if csv_files and jobs > 1:
+            convert_files_parallel(csv_files, output_dir, jobs, fast)
+        else:
+            for file in tqdm(csv_files, desc="Converting files"):
+                output_file = output_dir / (file.stem + '.tsv')
+                convert_csv_to_tsv(str(file), str(output_file), fast)
+                logging.info(f"Converted {file} to {output_file}")
         
         if not csv_files:
             logging.warning(f"No CSV files found in the directory: {input_path}")
@@ -49,6 +133,8 @@ def main():
     parser = argparse.ArgumentParser(description="Convert CSV file(s) to TSV file(s)")
     parser.add_argument('-i', '--input', required=True, help="Input CSV file or directory containing CSV files")
     parser.add_argument('-o', '--output', help="Output directory for TSV files (default: same as input)")
+    parser.add_argument('-j', '--jobs', type=int, default=1, help="Number of files to convert in parallel (default: 1)")
+    parser.add_argument('--no-fast', action='store_true', help="Always parse rows with the csv module instead of the block-based fast path")
     args = parser.parse_args()
 
     # Configure logging
@@ -67,7 +153,7 @@ def main():
     output_dir.mkdir(parents=True, exist_ok=True)
 
     logging.info(f"Processing input: {input_path}")
-    process_input(input_path, output_dir)
+    process_input(input_path, output_dir, args.jobs, not args.no_fast)
     logging.info("Conversion completed successfully")
 
 if __name__ == "__main__":
@@ -77,4 +163,5 @@ if __name__ == "__main__":
 # python script.py -i input.csv -o output_dir
 # python script.py -i input_directory
 # python script.py -i input_directory -o output_directory
+# python script.py -i input_directory -o output_directory -j 16  # 16 files in parallel
 # python script.py -h  # For help
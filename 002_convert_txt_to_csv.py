@@ -1,29 +1,211 @@
 import argparse
 import csv
+import gzip
+import io
+import os
+import queue
+import struct
+import threading
+import zlib
 from pathlib import Path
 from tqdm import tqdm
-import os
 
-def convert_tsv_to_csv(input_file, output_file):
+# Compressed formats handled transparently (by file suffix)
+COMPRESSION_SUFFIXES = ('.gz', '.bgz', '.zst')
+CHUNK_SIZE = 1024 * 1024
+QUEUE_DEPTH = 8
+
+# BGZF blocks hold at most 0xff00 bytes of uncompressed data (same as htslib)
+BGZF_BLOCK_SIZE = 0xff00
+BGZF_EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+def compression_of(path):
+    """Return the compression suffix of a path ('.gz', '.bgz', '.zst') or '' for plain text."""
+    suffix = Path(path).suffix.lower()
+    return suffix if suffix in COMPRESSION_SUFFIXES else ''
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("Reading or writing .zst files requires the 'zstandard' package (pip install zstandard)")
+    return zstandard
+
+class BGZFWriter(io.RawIOBase):
+    """Minimal BGZF writer: gzip members of <= 64 KiB with the 'BC' extra field, readable by bgzip/htslib."""
+
+    def __init__(self, fileobj, level=6):
+        self.fileobj = fileobj
+        self.level = level
+        self.buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= BGZF_BLOCK_SIZE:
+            self._write_block(bytes(self.buffer[:BGZF_BLOCK_SIZE]))
+            del self.buffer[:BGZF_BLOCK_SIZE]
+        return len(data)
+
+    def _write_block(self, data):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+        deflated = compressor.compress(data) + compressor.flush()
+        header = struct.pack('<4BI2BH2BHH', 0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6, 66, 67, 2, len(deflated) + 25)
+        self.fileobj.write(header + deflated + struct.pack('<II', zlib.crc32(data), len(data)))
+
+    def close(self):
+        if not self.closed:
+            if self.buffer:
+                self._write_block(bytes(self.buffer))
+                self.buffer.clear()
+            self.fileobj.write(BGZF_EOF)
+            self.fileobj.close()
+        super().close()
+
+def open_codec_reader(raw, compression):
+    """Wrap a raw binary file in a decompressing reader."""
+    if compression in ('.gz', '.bgz'):
+        return gzip.GzipFile(fileobj=raw, mode='rb')
+    if compression == '.zst':
+        return _zstd().ZstdDecompressor().stream_reader(raw)
+    return raw
+
+def open_codec_writer(raw, compression, level):
+    """Wrap a raw binary file in a compressing writer."""
+    if compression == '.gz':
+        return gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=level)
+    if compression == '.bgz':
+        return BGZFWriter(raw, level)
+    if compression == '.zst':
+        return _zstd().ZstdCompressor(level=level).stream_writer(raw)
+    return raw
+
+class ThreadedReader(io.RawIOBase):
+    """
+    Read (and decompress) a file on a background thread.
+    
+    Decompressed chunks are handed over through a bounded queue, so the codec
+    runs concurrently with parsing (zlib and zstd release the GIL).
+    The `progress` callback receives the number of on-disk bytes consumed.
+    """
+
+    def __init__(self, path, progress=None, chunk_size=CHUNK_SIZE):
+        self.raw = open(path, 'rb')
+        self.stream = open_codec_reader(self.raw, compression_of(path))
+        self.progress = progress
+        self.chunk_size = chunk_size
+        self.queue = queue.Queue(maxsize=QUEUE_DEPTH)
+        self.pending = b''
+        self.position = 0
+        self.thread = threading.Thread(target=self._produce, daemon=True)
+        self.thread.start()
+
+    def _produce(self):
+        try:
+            while True:
+                chunk = self.stream.read(self.chunk_size)
+                self.queue.put((chunk, self.raw.tell()))
+                if not chunk:
+                    break
+        except Exception as e:
+            self.queue.put((e, None))
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.pending:
+            chunk, position = self.queue.get()
+            if isinstance(chunk, Exception):
+                raise chunk
+            if not chunk:
+                return 0
+            if self.progress:
+                self.progress(position - self.position)
+            self.position = position
+            self.pending = chunk
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            self.stream.close()
+            self.raw.close()
+        super().close()
+
+class ThreadedWriter(io.RawIOBase):
+    """Write (and compress) a file on a background thread fed through a bounded queue."""
+
+    def __init__(self, path, level=6):
+        self.stream = open_codec_writer(open(path, 'wb'), compression_of(path), level)
+        self.queue = queue.Queue(maxsize=QUEUE_DEPTH)
+        self.error = None
+        self.thread = threading.Thread(target=self._consume, daemon=True)
+        self.thread.start()
+
+    def _consume(self):
+        while True:
+            chunk = self.queue.get()
+            if chunk is None:
+                break
+            if self.error is None:
+                try:
+                    self.stream.write(chunk)
+                except Exception as e:
+                    self.error = e
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if self.error is not None:
+            raise self.error
+        self.queue.put(bytes(data))
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self.queue.put(None)
+            self.thread.join()
+            self.stream.close()
+            if self.error is not None:
+                raise self.error
+        super().close()
+
+def convert_tsv_to_csv(input_file, output_file, level=6):
     """
-    Convert a tab-separated (TSV) file to a comma-separated (CSV) file.
+    Convert a tab-separated (TSV) file to a comma-separated (CSV) file in a single pass.
+    
+    Plain, .gz, .bgz and .zst inputs and outputs are detected from the file suffix;
+    (de)compression runs on background threads. Progress is reported in bytes read.
     
     Args:
         input_file (str): Path to the input TSV file
         output_file (str): Path to the output CSV file
+        level (int): Compression level for compressed outputs
     """
-    with open(input_file, 'r', newline='') as tsv_file, \
-         open(output_file, 'w', newline='') as csv_file:
-        
-        tsv_reader = csv.reader(tsv_file, delimiter='\t')
-        csv_writer = csv.writer(csv_file)
-        
-        # Use tqdm to show progress
-        total_lines = sum(1 for _ in open(input_file))
-        for row in tqdm(tsv_reader, total=total_lines, desc="Converting"):
-            csv_writer.writerow(row)
-
-def process_files(input_path, output_path):
+    with tqdm(total=os.path.getsize(input_file), unit='B', unit_scale=True, desc="Converting") as pbar:
+        reader = ThreadedReader(input_file, progress=pbar.update)
+        writer = ThreadedWriter(output_file, level)
+        with io.TextIOWrapper(io.BufferedReader(reader, CHUNK_SIZE), newline='') as tsv_file, \
+             io.TextIOWrapper(io.BufferedWriter(writer, CHUNK_SIZE), newline='') as csv_file:
+            
+            tsv_reader = csv.reader(tsv_file, delimiter='\t')
+            csv_writer = csv.writer(csv_file)
+            csv_writer.writerows(tsv_reader)
+
+def csv_name(tsv_path):
+    """Return the CSV file name for a TSV path, keeping any compression suffix (a.txt.gz -> a.csv.gz)."""
+    tsv_path = Path(tsv_path)
+    compression = compression_of(tsv_path)
+    stem = Path(tsv_path.stem) if compression else tsv_path
+    return stem.with_suffix('.csv').name + compression
+
+def process_files(input_path, output_path, level=6):
     # Create output directory if it doesn't exist
     if os.path.isdir(input_path):
         os.makedirs(output_path, exist_ok=True)
@@ -37,31 +219,34 @@ def process_files(input_path, output_path):
 
     if os.path.isfile(input_path):
         # Process single file
-        convert_tsv_to_csv(input_path, output_path)
+        convert_tsv_to_csv(input_path, output_path, level)
     elif os.path.isdir(input_path):
-        # Process directory
-        for tsv_file in Path(input_path).glob('*.txt'):
-            csv_file = os.path.join(output_path, tsv_file.with_suffix('.csv').name)
-            convert_tsv_to_csv(str(tsv_file), csv_file)
+        # Process directory (plain and compressed .txt files)
+        for pattern in ['*.txt'] + [f'*.txt{suffix}' for suffix in COMPRESSION_SUFFIXES]:
+            for tsv_file in sorted(Path(input_path).glob(pattern)):
+                csv_file = os.path.join(output_path, csv_name(tsv_file))
+                convert_tsv_to_csv(str(tsv_file), csv_file, level)
     else:
         raise ValueError("Input must be a file or directory.")
 
 def main():
-    parser = argparse.ArgumentParser(description="Convert tab-separated (TSV) files to comma-separated (CSV) files.")
+    parser = argparse.ArgumentParser(description="Convert tab-separated (TSV) files to comma-separated (CSV) files. "
+                                                 "Reads and writes .gz, .bgz and .zst files transparently (by suffix).")
     parser.add_argument("-i", "--input", required=True, help="Input TSV file or directory path")
     parser.add_argument("-o", "--output", help="Output CSV file or directory path (default: input_name.csv or input_dir_csv)")
+    parser.add_argument("-l", "--level", type=int, default=6, help="Compression level for .gz/.bgz/.zst outputs (default: 6)")
     args = parser.parse_args()
 
     input_path = Path(args.input)
     if not args.output:
         if input_path.is_file():
-            output_path = input_path.with_suffix('.csv')
+            output_path = input_path.with_name(csv_name(input_path))
         else:
             output_path = input_path.with_name(f"{input_path.name}_csv")
     else:
         output_path = Path(args.output)
 
-    process_files(input_path, output_path)
+    process_files(input_path, output_path, args.level)
     print(f"Conversion complete. Output: {output_path}")
 
 if __name__ == "__main__":
@@ -69,6 +254,7 @@ if __name__ == "__main__":
 
 # Usage examples:
 # python script_name.py -i input.txt -o output.csv
+# python script_name.py -i input.txt.gz -o output.csv.zst
 # python script_name.py -i input_dir -o output_dir
 # For help: python script_name.py -h
 
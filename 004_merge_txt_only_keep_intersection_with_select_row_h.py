@@ -1,7 +1,9 @@
 import pandas as pd
 import argparse
 import sys
+from pathlib import Path
 from tqdm import tqdm
+from hash_join import multi_merge, partitioned_merge
 
 def parse_columns(column_input, df):
     """Parse the column input, which can be column names or column indices."""
@@ -27,44 +29,71 @@ def parse_column_ranges(column_input, df):
             columns.append(col)
     return columns
 
-def merge_files(main_file, main_col, main_cols_to_add, aux_file, aux_col, aux_cols_to_add, output_file):
-    # Load the main file and auxiliary file
+def merge_files(main_file, main_col, main_cols_to_add, aux_file, aux_col, aux_cols_to_add, output_file, joins=None, memory=None, temp_dir=None):
+    # Accept a single auxiliary file or lists of repeated -a/-ac/-ac_add groups
+    aux_files = [aux_file] if isinstance(aux_file, str) else list(aux_file)
+    aux_cols = [aux_col] if isinstance(aux_col, str) else list(aux_col)
+    aux_cols_to_add = [aux_cols_to_add] if isinstance(aux_cols_to_add, str) else list(aux_cols_to_add)
+    joins = list(joins) if joins else ['inner'] * len(aux_files)
+    if not len(aux_files) == len(aux_cols) == len(aux_cols_to_add) == len(joins):
+        print("Each auxiliary file (-a) needs its own -ac, -ac_add (and -j, if given).")
+        sys.exit(1)
+    
+    # Read only the headers first so that just the requested columns are loaded
     try:
-        main_df = pd.read_csv(main_file, sep='\t')
-        aux_df = pd.read_csv(aux_file, sep='\t')
+        main_header = pd.read_csv(main_file, sep='\t', nrows=0)
+        aux_headers = [pd.read_csv(file, sep='\t', nrows=0) for file in aux_files]
     except Exception as e:
         print(f"Error reading files: {e}")
         sys.exit(1)
     
     # Check if the columns exist
-    if main_col not in main_df.columns:
+    if main_col not in main_header.columns:
         print(f"Main column '{main_col}' not found in main file.")
         sys.exit(1)
     
-    if aux_col not in aux_df.columns:
-        print(f"Auxiliary column '{aux_col}' not found in auxiliary file.")
-        sys.exit(1)
-    
-    # Parse the columns to add
-    main_cols_to_add_parsed = parse_column_ranges(main_cols_to_add, main_df)
-    aux_cols_to_add_parsed = parse_column_ranges(aux_cols_to_add, aux_df)
-    
-    missing_main_cols = [col for col in main_cols_to_add_parsed if col not in main_df.columns]
+    main_cols_to_add_parsed = parse_column_ranges(main_cols_to_add, main_header)
+    missing_main_cols = [col for col in main_cols_to_add_parsed if col not in main_header.columns]
     if missing_main_cols:
         print(f"Columns {missing_main_cols} not found in main file.")
         sys.exit(1)
+    main_columns = [main_col] + main_cols_to_add_parsed
     
-    missing_aux_cols = [col for col in aux_cols_to_add_parsed if col not in aux_df.columns]
-    if missing_aux_cols:
-        print(f"Columns {missing_aux_cols} not found in auxiliary file.")
-        sys.exit(1)
+    # Parse the columns to add from every auxiliary file
+    aux_specs = []
+    for file, header, col, cols_to_add, how in zip(aux_files, aux_headers, aux_cols, aux_cols_to_add, joins):
+        if col not in header.columns:
+            print(f"Auxiliary column '{col}' not found in auxiliary file {file}.")
+            sys.exit(1)
+        
+        cols_to_add_parsed = parse_column_ranges(cols_to_add, header)
+        missing_aux_cols = [c for c in cols_to_add_parsed if c not in header.columns]
+        if missing_aux_cols:
+            print(f"Columns {missing_aux_cols} not found in auxiliary file {file}.")
+            sys.exit(1)
+        aux_specs.append((file, [col] + cols_to_add_parsed, col, how, Path(file).stem))
     
-    # Merge the files using inner join to keep only matching rows from both files
-    merged_df = pd.merge(main_df[[main_col] + main_cols_to_add_parsed], aux_df[[aux_col] + aux_cols_to_add_parsed], left_on=main_col, right_on=aux_col, how='inner')
+    # Out-of-core mode: hash-partition all files on disk and join partition by partition
+    if memory:
+        try:
+            rows = partitioned_merge(main_file, main_columns, main_col, aux_specs, output_file, memory, temp_dir)
+            print(f"Successfully saved the merged file ({rows} rows) to {output_file}")
+        except Exception as e:
+            print(f"Error during out-of-core merge: {e}")
+            sys.exit(1)
+        return
+    
+    # Load the main file once, then the requested columns of each auxiliary file
+    try:
+        main_df = pd.read_csv(main_file, sep='\t', usecols=list(dict.fromkeys(main_columns)))[main_columns]
+        aux_tables = [(pd.read_csv(file, sep='\t', usecols=list(dict.fromkeys(columns)))[columns], col, how, name)
+                      for file, columns, col, how, name in aux_specs]
+    except Exception as e:
+        print(f"Error reading files: {e}")
+        sys.exit(1)
     
-    # Rename the auxiliary column to match the main column if they are different
-    if main_col != aux_col:
-        merged_df.drop(columns=[aux_col], inplace=True)
+    # Merge the files one by one (default: inner join to keep only matching rows)
+    merged_df = multi_merge(main_df, main_col, aux_tables)
     
     # Save the result to a new file
     try:
@@ -75,19 +104,23 @@ def merge_files(main_file, main_col, main_cols_to_add, aux_file, aux_col, aux_co
         sys.exit(1)
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Merge two tab-separated files based on a matching column, and add specified columns from the auxiliary file to the main file. Columns can be specified by name, index, or range (e.g., 3-5).")
+    parser = argparse.ArgumentParser(description="Merge tab-separated files based on a matching column, and add specified columns from one or more auxiliary files to the main file. Columns can be specified by name, index, or range (e.g., 3-5). Repeat -a/-ac/-ac_add (and optionally -j) to attach several auxiliary files in a single pass.",
+                                     epilog="Example: %(prog)s -m contigs.txt -mc Contig_ID -mc_add 1-3 -a padloc.txt -ac seqid -ac_add 2,3 -j left -a amrfinder.txt -ac Contig_ID -ac_add 5 -j inner -o merged.txt")
 
     # Add arguments
     parser.add_argument("-m", "--main_file", required=True, help="Path to the main file (tab-separated).")
     parser.add_argument("-mc", "--main_col", required=True, help="Column name in the main file to match.")
     parser.add_argument("-mc_add", "--main_cols_to_add", required=True, help="Column names, indices, or ranges in the main file to add to the merged file.")
-    parser.add_argument("-a", "--aux_file", required=True, help="Path to the auxiliary file (tab-separated).")
-    parser.add_argument("-ac", "--aux_col", required=True, help="Column name in the auxiliary file to match.")
-    parser.add_argument("-ac_add", "--aux_cols_to_add", required=True, help="Column names, indices, or ranges in the auxiliary file to add to the merged file.")
+    parser.add_argument("-a", "--aux_file", required=True, action="append", help="Path to the auxiliary file (tab-separated). Repeat for several auxiliary files.")
+    parser.add_argument("-ac", "--aux_col", required=True, action="append", help="Column name in the auxiliary file to match (one per -a).")
+    parser.add_argument("-ac_add", "--aux_cols_to_add", required=True, action="append", help="Column names, indices, or ranges in the auxiliary file to add to the merged file (one per -a).")
+    parser.add_argument("-j", "--join", action="append", choices=['outer', 'inner', 'left'], help="Join type for each auxiliary file (one per -a, default: inner).")
     parser.add_argument("-o", "--output_file", required=True, help="Path to save the output merged file (tab-separated).")
+    parser.add_argument("--memory", help="Memory budget (e.g. 4G) for the out-of-core join; all files are hash-partitioned on disk and joined partition by partition.")
+    parser.add_argument("--temp_dir", help="Directory for the out-of-core partition files (default: system temp dir).")
 
     # Parse arguments
     args = parser.parse_args()
 
     # Call the merge function
-    merge_files(args.main_file, args.main_col, args.main_cols_to_add, args.aux_file, args.aux_col, args.aux_cols_to_add, args.output_file)
\ No newline at end of file
+    merge_files(args.main_file, args.main_col, args.main_cols_to_add, args.aux_file, args.aux_col, args.aux_cols_to_add, args.output_file, args.join, args.memory, args.temp_dir)
\ No newline at end of file
@@ -1,8 +1,13 @@
 import argparse
 import os
 import csv
+import gzip
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 
+# Block size used by the fast mode when copying file bodies
+BLOCK_SIZE = 16 * 1024 * 1024
+
 def merge_files(input_files, output_file, file_type):
     delimiter = '\t' if file_type == 'txt' else ','
     with open(output_file, 'w', newline='') as outfile:
@@ -18,38 +23,100 @@ def merge_files(input_files, output_file, file_type):
                     for row in reader:
                         writer.writerow(row)
 
-def collect_files(input_paths, file_type):
-    all_files = []
-    for path in input_paths:
-        if os.path.isdir(path):
-            for file in os.listdir(path):
-                if file.endswith(f'.{file_type}'):
-                    all_files.append(os.path.join(path, file))
-        elif os.path.isfile(path) and path.endswith(f'.{file_type}'):
-            all_files.append(path)
+def open_binary(path, mode='rb'):
+    """Open a plain or gzip-compressed file in binary mode."""
+    return gzip.open(path, mode) if path.endswith('.gz') else open(path, mode)
+
+def read_header(path):
+    """Return the first line of a file, including its line ending."""
+    with open_binary(path) as infile:
+        return infile.readline()
+
+def merge_files_fast(input_files, output_file, jobs=8):
+    """
+    Concatenate files without parsing rows: keep the first header and copy
+    the remaining bytes of every file in large blocks.
+    
+    Every header must match the first file's header, otherwise nothing is written.
+    """
+    # 1. Check all headers (in parallel) before writing anything
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        headers = list(tqdm(executor.map(read_header, input_files), total=len(input_files), desc="Checking headers"))
+    # Compare without line endings, so LF and CRLF copies of one header match
+    first = headers[0].rstrip(b'\r\n')
+    mismatched = [f for f, header in zip(input_files, headers) if header and header.rstrip(b'\r\n') != first]
+    if mismatched:
+        raise ValueError(f"Header differs from {input_files[0]} in {len(mismatched)} file(s), e.g. {mismatched[0]}")
+
+    # 2. Copy the bodies block by block, making sure every file ends with a newline
+    # The first header is written exactly as read, and its line ending is reused for missing final newlines
+    newline = headers[0][len(first):] or b'\n'
+    with open_binary(output_file, 'wb') as outfile:
+        outfile.write(first + newline)
+        for input_file in tqdm(input_files, desc="Merging Files"):
+            with open_binary(input_file) as infile:
+                infile.readline()  # Skip header
+                last = b'\n'
+                while True:
+                    block = infile.read(BLOCK_SIZE)
+                    if not block:
+                        break
+                    outfile.write(block)
+                    last = block[-1:]
+                if last != b'\n':
+                    outfile.write(newline)
+
+def list_directory(path, suffixes):
+    return [os.path.join(path, file) for file in os.listdir(path) if file.endswith(suffixes)]
+
+def collect_files(input_paths, file_type, compressed=False, jobs=8):
+    suffixes = (f'.{file_type}', f'.{file_type}.gz') if compressed else (f'.{file_type}',)
+    # List directories in parallel, keeping the order of the input paths
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        listings = {path: executor.submit(list_directory, path, suffixes)
+                    for path in input_paths if os.path.isdir(path)}
+        all_files = []
+        for path in input_paths:
+            if path in listings:
+                all_files.extend(listings[path].result())
+            elif os.path.isfile(path) and path.endswith(suffixes):
+                all_files.append(path)
     return all_files
 
 def main():
     parser = argparse.ArgumentParser(
         description='Merge multiple text or CSV files into one. Accepts files and directories.',
         formatter_class=argparse.RawTextHelpFormatter,
-        epilog='Example: %(prog)s -i file1.txt dir1 file2.txt -o merged_output.txt -t txt'
+        epilog='Example: %(prog)s -i file1.txt dir1 file2.txt -o merged_output.txt -t txt\n'
+               'Fast mode (plain and .gz inputs, no row parsing): %(prog)s -i dir1 dir2 -o merged.txt -t txt --fast -j 16'
     )
     parser.add_argument('-i', '--input', type=str, nargs='+', required=True,
                         help='Input files or directories to merge. Usage: -i file1.txt dir1 ...')
     parser.add_argument('-o', '--output', type=str, required=True,
-                        help='Output file to save the merged content.')
+                        help='Output file to save the merged content (.gz to compress in fast mode).')
     parser.add_argument('-t', '--type', type=str, choices=['txt', 'csv'], required=True,
                         help='File type to process (txt or csv)')
+    parser.add_argument('-f', '--fast', action='store_true',
+                        help='Check that headers match, then copy file bodies in large blocks without parsing rows.\n'
+                             'Also accepts .gz inputs.')
+    parser.add_argument('-j', '--jobs', type=int, default=8,
+                        help='Number of threads for listing directories and checking headers (default: 8)')
     args = parser.parse_args()
 
-    input_files = collect_files(args.input, args.type)
+    input_files = collect_files(args.input, args.type, args.fast, args.jobs)
 
     if not input_files:
         print(f'Error: No valid {args.type} files found to merge.')
         return
 
-    merge_files(input_files, args.output, args.type)
+    if args.fast:
+        try:
+            merge_files_fast(input_files, args.output, args.jobs)
+        except ValueError as e:
+            print(f'Error: {e}')
+            return
+    else:
+        merge_files(input_files, args.output, args.type)
     print('Merge completed successfully.')
 
 if __name__ == '__main__':
@@ -1,44 +1,86 @@
 import os
 import argparse
+import numpy as np
 from tqdm import tqdm
+from fasta_index import FastaIndex
 
-def split_fasta(input_file, output_dir, chunk_size=1000):
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
+# Bytes copied per write
+COPY_SIZE = 16 * 1024 * 1024
 
-    count = 0
-    file_count = 1
-    buffer = []
+def chunk_boundaries(lengths, chunk_size=None, chunk_bases=None):
+    """
+    Return (first, last) record ranges (last exclusive) for each chunk.
 
-    with open(input_file, 'r') as f:
-        for line in tqdm(f, desc="Reading lines"):
-            buffer.append(line)
+    A chunk is closed once it holds chunk_size records or chunk_bases bases
+    (whichever comes first), so chunks overshoot the base target by at most one record.
+    """
+    cumulative = np.concatenate(([0], np.cumsum(lengths)))
+    boundaries = []
+    first = 0
+    while first < len(lengths):
+        last = len(lengths)
+        if chunk_size:
+            last = min(last, first + chunk_size)
+        if chunk_bases:
+            last = min(last, max(first + 1, int(np.searchsorted(cumulative, cumulative[first] + chunk_bases, 'left'))))
+        boundaries.append((first, last))
+        first = last
+    return boundaries
 
-            if line.startswith('>'):
-                count += 1
+def split_fasta(input_file, output_dir, chunk_size=None, chunk_bases=None):
+    """
+    Split a FASTA file into chunks by record count and/or total bases.
 
-            if count > chunk_size:
-                output_file = os.path.join(output_dir, f'split_{file_count}.fasta')
-                with open(output_file, 'w') as out_f:
-                    out_f.writelines(buffer[:-1])
+    Chunk boundaries are computed from the cached FASTA index; each chunk is one
+    contiguous byte range that is streamed from a memory map straight to its file.
+    Without any limit, chunks of 1000 records are written.
+    """
+    if chunk_size is None and chunk_bases is None:
+        chunk_size = 1000
+    os.makedirs(output_dir, exist_ok=True)
 
-                buffer = [buffer[-1]]
-                count = 1
-                file_count += 1
+    # 1. Load (or build and cache) the FASTA index
+    index = FastaIndex.load(input_file)
+    if not len(index):
+        print(f"No sequences found in {input_file}")
+        return []
 
-    if buffer:
-        output_file = os.path.join(output_dir, f'split_{file_count}.fasta')
-        with open(output_file, 'w') as out_f:
-            out_f.writelines(buffer)
+    # 2. Compute the chunk boundaries from the record lengths
+    boundaries = chunk_boundaries(index.lengths, chunk_size, chunk_bases)
+    starts, ends = index.starts, index.ends
+
+    # 3. Copy each chunk's byte range to its output file
+    chunk_stats = []
+    with index, tqdm(total=index.size, unit='B', unit_scale=True, desc="Splitting") as pbar:
+        view = memoryview(index.mmap())
+        try:
+            for file_count, (first, last) in enumerate(boundaries, 1):
+                # Text before the first header goes to the first chunk
+                begin = 0 if first == 0 else int(starts[first])
+                end = int(ends[last - 1])
+                with open(os.path.join(output_dir, f'split_{file_count}.fasta'), 'wb') as out_f:
+                    for position in range(begin, end, COPY_SIZE):
+                        out_f.write(view[position:min(position + COPY_SIZE, end)])
+                pbar.update(end - begin)
+                chunk_stats.append((last - first, int(index.lengths[first:last].sum())))
+        finally:
+            view.release()
+
+    chunk_bases_list = [b for _, b in chunk_stats]
+    print(f"Wrote {len(chunk_stats)} chunks to {output_dir} "
+          f"(bases per chunk: min {min(chunk_bases_list)}, max {max(chunk_bases_list)})")
+    return chunk_stats
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description='Split a FASTA file into smaller chunks based on the number of sequences.',
-                                     epilog="Example usage: python script_name.py -i path/to/your/input.fasta -o path/to/output/directory -s 500\nReplace 'script_name.py' with this script's filename, and specify the paths and chunk size as needed.")
+    parser = argparse.ArgumentParser(description='Split a FASTA file into smaller chunks based on the number of sequences and/or total bases.',
+                                     epilog="Example usage: python script_name.py -i path/to/your/input.fasta -o path/to/output/directory -s 500\n"
+                                            "Balanced by size: python script_name.py -i input.fasta -o out_dir -b 50000000\n"
+                                            "Replace 'script_name.py' with this script's filename, and specify the paths and chunk size as needed.")
     parser.add_argument('-i', dest='input_file', type=str, required=True, help='Path to the input FASTA file.')
     parser.add_argument('-o', dest='output_dir', type=str, required=True, help='Path to the output directory.')
-    parser.add_argument('-s', dest='chunk_size', type=int, default=1000, help='Number of sequences per chunk.')
+    parser.add_argument('-s', dest='chunk_size', type=int, default=None, help='Number of sequences per chunk (default: 1000 if -b is not given).')
+    parser.add_argument('-b', dest='chunk_bases', type=int, default=None, help='Target number of bases per chunk; can be combined with -s.')
 
     args = parser.parse_args()
 
-    split_fasta(args.input_file, args.output_dir, args.chunk_size)
-
+    split_fasta(args.input_file, args.output_dir, args.chunk_size, args.chunk_bases)
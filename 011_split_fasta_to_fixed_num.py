@@ -1,25 +1,76 @@
 import argparse
-from math import ceil
+import heapq
+import mmap
+import os
+from concurrent.futures import ThreadPoolExecutor
 
-def split_fasta(fasta_file, num_files):
-    with open(fasta_file, 'r') as file:
-        sequences = file.read().split('>')[1:]
+import numpy as np
+from tqdm import tqdm
+from fasta_index import FastaIndex
 
-    sequences_per_file = ceil(len(sequences) / num_files)
+def assign_bins(lengths, num_files):
+    """Assign records to bins largest-first, always into the bin with the fewest bases."""
+    bins = np.zeros(len(lengths), dtype=np.int64)
+    heap = [(0, i) for i in range(num_files)]
+    for record in np.argsort(-lengths, kind='stable'):
+        load, i = heapq.heappop(heap)
+        bins[record] = i
+        heapq.heappush(heap, (load + int(lengths[record]), i))
+    return bins
 
-    for i in range(num_files):
-        output_file_name = f"{fasta_file.rsplit('.', 1)[0]}_{i+1}.fasta"
-        with open(output_file_name, 'w') as output_file:
-            for sequence in sequences[i * sequences_per_file : (i + 1) * sequences_per_file]:
-                output_file.write(f">{sequence}")
+def write_bin(mm, output_file_name, starts, ends, size):
+    """Copy the byte ranges of one bin (in input order) from the memory map to a file."""
+    view = memoryview(mm)
+    try:
+        with open(output_file_name, 'wb') as output_file:
+            # Coalesce neighbouring records into one range
+            i = 0
+            while i < len(starts):
+                j = i
+                while j + 1 < len(starts) and starts[j + 1] == ends[j]:
+                    j += 1
+                output_file.write(view[starts[i]:ends[j]])
+                if ends[j] == size and mm[size - 1] != 10:
+                    output_file.write(b'\n')
+                i = j + 1
+    finally:
+        view.release()
+
+def split_fasta(fasta_file, num_files, threads=4):
+    # 1. Load (or build and cache) the index of record offsets and sequence lengths
+    index = FastaIndex.load(fasta_file)
+    starts, ends, lengths = index.starts, index.ends, index.lengths
+    index.close()
+
+    # 2. Balance the total bases of the output files
+    bins = assign_bins(lengths, num_files)
+
+    # 3. Copy byte ranges from the memory-mapped input into each output in parallel
+    output_names = [f"{fasta_file.rsplit('.', 1)[0]}_{i+1}.fasta" for i in range(num_files)]
+    size = os.path.getsize(fasta_file)
+    with open(fasta_file, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            futures = [executor.submit(write_bin, mm, output_names[i], starts[bins == i], ends[bins == i], size)
+                       for i in range(num_files)]
+            for future in tqdm(futures, desc="Writing files"):
+                future.result()
+        if size:
+            mm.close()
+
+    for i, name in enumerate(output_names):
+        print(f"{name}: {np.count_nonzero(bins == i)} sequences, {lengths[bins == i].sum()} bases")
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description='Split a FASTA file into a specified number of smaller files.',
-                                     epilog='Example: %(prog)s -i input.fasta -n 3')
+    parser = argparse.ArgumentParser(description='Split a FASTA file into a specified number of smaller files with balanced total sequence length. '
+                                                 'Records are indexed by byte offset, assigned largest-first to the least filled file, '
+                                                 'and copied from a memory-mapped input in parallel.',
+                                     epilog='Example: %(prog)s -i input.fasta -n 3 -t 3')
     parser.add_argument('-i', type=str, required=True, help='Path to the input FASTA file')
     parser.add_argument('-n', type=int, required=True, help='Number of smaller FASTA files to create')
+    parser.add_argument('-t', '--threads', type=int, default=4, help='Number of files written in parallel (default: 4)')
     args = parser.parse_args()
 
-    split_fasta(args.i, args.n)
+    split_fasta(args.i, args.n, args.threads)
 
     print(f"Successfully split {args.i} into {args.n} files.")
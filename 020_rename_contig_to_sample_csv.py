@@ -1,7 +1,8 @@
 import pandas as pd
 import argparse
+from sample_names import extract_sample_names_parallel
 
-def process_csv_data(input_file_path, output_file_path, id_column='ID', sample_column='Sample_Name'):
+def process_csv_data(input_file_path, output_file_path, id_column='ID', sample_column='Sample_Name', jobs=1):
     """
     Process CSV file to extract and transform sample names from ID column.
     
@@ -15,45 +16,16 @@ def process_csv_data(input_file_path, output_file_path, id_column='ID', sample_c
         Name of the column containing IDs (default: 'ID')
     sample_column : str
         Name of the new column to be created for sample names (default: 'Sample_Name')
+    jobs : int
+        Number of processes for extracting sample names from large tables (default: 1)
     """
     try:
         # Load the CSV file
         data = pd.read_csv(input_file_path)
         print(f"Successfully loaded {input_file_path}")
         
-        # Function to extract sample name from ID
-        def extract_sample_name(id_value):
-            """
-            Extract sample name from ID following specific patterns.
-            Modify this function according to your ID pattern.
-            """
-            try:
-                if pd.isna(id_value):
-                    return None
-                    
-                id_str = str(id_value).strip()
-                
-                # Pattern matching for different ID formats
-                if id_str.startswith('18097D'):
-                    parts = id_str.split('-')
-                    if len(parts) >= 3:
-                        number_part = ''.join(filter(str.isdigit, parts[2]))
-                        return f'Sample_{int(number_part):02d}' if number_part else None
-                        
-                elif id_str.startswith('DP'):
-                    parts = id_str.split('-')
-                    if len(parts) >= 2:
-                        number_part = ''.join(filter(str.isdigit, parts[1]))
-                        return f'Sample_{int(number_part):02d}' if number_part else None
-                        
-                return None
-                
-            except Exception as e:
-                print(f"Error processing ID {id_value}: {str(e)}")
-                return None
-
-        # Apply the extraction function and create new column
-        data[sample_column] = data[id_column].apply(extract_sample_name)
+        # Extract sample names with one vectorised regex pass (see sample_names.SAMPLE_ID_PATTERNS)
+        data[sample_column] = extract_sample_names_parallel(data[id_column], jobs)
         
         # Count successful transformations
         successful_transforms = data[sample_column].notna().sum()
@@ -101,6 +73,11 @@ def main():
                        type=str, 
                        default='Sample_Name',
                        help='Name of the new column for sample names (default: Sample_Name)')
+                       
+    parser.add_argument('--jobs', 
+                       type=int, 
+                       default=1,
+                       help='Number of processes for sample name extraction (default: 1)')
 
     args = parser.parse_args()
 
@@ -109,7 +86,8 @@ def main():
         args.input_file,
         args.output_file,
         args.id_column,
-        args.sample_column
+        args.sample_column,
+        args.jobs
     )
     
     # Print summary statistics
@@ -1,48 +1,127 @@
 import argparse
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
+from abundance_matrix import read_sparse, is_sparse_file
+
+# Default order of the 'Sample_' columns, used when no order file is given
+SAMPLE_ORDER = [
+    "Sample_01", "Sample_02", "Sample_06", "Sample_07", "Sample_11", "Sample_12", "Sample_40", "Sample_41",
+    "Sample_45", "Sample_46", "Sample_50", "Sample_51", "Sample_28", "Sample_32", "Sample_36", "Sample_67",
+    "Sample_71", "Sample_75", "Sample_16", "Sample_20", "Sample_24", "Sample_55", "Sample_59", "Sample_63",
+    "Sample_03", "Sample_08", "Sample_13", "Sample_42", "Sample_47", "Sample_52", "Sample_29", "Sample_33",
+    "Sample_37", "Sample_68", "Sample_72", "Sample_76", "Sample_17", "Sample_21", "Sample_25", "Sample_56",
+    "Sample_60", "Sample_64", "Sample_04", "Sample_09", "Sample_14", "Sample_43", "Sample_48", "Sample_53",
+    "Sample_30", "Sample_34", "Sample_38", "Sample_69", "Sample_73", "Sample_77", "Sample_18", "Sample_22",
+    "Sample_26", "Sample_57", "Sample_61", "Sample_65", "Sample_05", "Sample_10", "Sample_15", "Sample_44",
+    "Sample_49", "Sample_54", "Sample_31", "Sample_35", "Sample_39", "Sample_70", "Sample_74", "Sample_78",
+    "Sample_19", "Sample_23", "Sample_27", "Sample_58", "Sample_62", "Sample_66"
+]
+
+def load_sample_order(order_file=None, order_column='Sample'):
+    """Read the sample order from a metadata CSV (rows in order), or return the default order."""
+    if order_file is None:
+        return SAMPLE_ORDER
+    order = pd.read_csv(order_file, usecols=[order_column], dtype=str)[order_column]
+    return order.dropna().str.strip().drop_duplicates().tolist()
+
+def kept_contigs(contigs):
+    """Boolean mask of contig IDs that are neither 'Unknown' nor end with 'bam'."""
+    contig_ids = pd.Series(contigs, dtype=object).str.lower()
+    return (~(contig_ids == 'unknown') & ~contig_ids.str.endswith('bam', na=False)).to_numpy()
+
+def filter_rows(df):
+    """Drop rows where Contig_ID is 'Unknown' or ends with 'bam'."""
+    return df[kept_contigs(df['Contig_ID'])]
+
+def rename_reorder_and_filter_sparse(input_file, output_file, sample_order, chunksize=None):
+    """
+    Same steps on a sparse .npz matrix (see abundance_matrix.py), touching only the stored values.
+
+    The output is again a sparse .npz matrix if its name ends in .npz, otherwise a CSV
+    written in blocks of rows, so the whole matrix is never densified.
+    """
+    # Step 1: Open the memory-mapped matrix
+    matrix = read_sparse(input_file)
+
+    # Step 2: Rename the sample columns by position
+    new_headers = [f'Sample_{str(i).zfill(2)}' for i in range(1, matrix.shape[1] + 1)]
+
+    # Step 3: Reorder the columns and drop 'Unknown' and '*bam' rows
+    positions = {name: i for i, name in enumerate(new_headers)}
+    columns = [positions[col] for col in sample_order if col in positions]
+    rows = kept_contigs(matrix.contigs)
+    print(f"Loaded {matrix.shape[0]} rows ({matrix.nnz} non-zero values) from {input_file}")
+    result = matrix.select(rows=rows, columns=columns)
+    result.samples = np.array([new_headers[i] for i in columns])
+
+    # Step 4: Save as sparse matrix or as CSV, block by block
+    if is_sparse_file(output_file):
+        result.write(output_file)
+    else:
+        block = chunksize or 100000
+        with open(output_file, 'w', newline='') as out:
+            for start in tqdm(range(0, result.shape[0], block), desc="Writing blocks", unit='block'):
+                df = pd.DataFrame(result.to_dense(start, start + block), columns=result.samples)
+                df.insert(0, 'Contig_ID', result.contigs[start:start + block])
+                df.to_csv(out, index=False, header=(start == 0))
+            if result.shape[0] == 0:
+                out.write(','.join(['Contig_ID'] + list(result.samples)) + '\n')
+    return matrix.shape[0], result.shape[0]
 
 # Function to rename and reorder columns, and filter rows
-def rename_reorder_and_filter(input_file, output_file):
+def rename_reorder_and_filter(input_file, output_file, order_file=None, order_column='Sample', chunksize=None):
     try:
-        # Step 1: Read the CSV file
-        df = pd.read_csv(input_file)
-        print(f"Loaded {len(df)} rows from {input_file}")
+        if is_sparse_file(input_file):
+            original_row_count, filtered_row_count = rename_reorder_and_filter_sparse(
+                input_file, output_file, load_sample_order(order_file, order_column), chunksize)
+            print(f"Filtered out {original_row_count - filtered_row_count} rows")
+            print(f"Header renaming, reordering, and filtering completed successfully. Saved {filtered_row_count} rows to {output_file}")
+            return
+
+        # Step 1: Read the header of the CSV file
+        header = pd.read_csv(input_file, nrows=0).columns
 
         # Step 2: Rename the columns
-        new_headers = ['Contig_ID'] + [f'Sample_{str(i).zfill(2)}' for i in range(1, len(df.columns))]
-        df.columns = new_headers
-
-        # Step 3: Reorder the 'Sample_' columns according to the given order
-        sample_order = [
-            "Sample_01", "Sample_02", "Sample_06", "Sample_07", "Sample_11", "Sample_12", "Sample_40", "Sample_41",
-            "Sample_45", "Sample_46", "Sample_50", "Sample_51", "Sample_28", "Sample_32", "Sample_36", "Sample_67",
-            "Sample_71", "Sample_75", "Sample_16", "Sample_20", "Sample_24", "Sample_55", "Sample_59", "Sample_63",
-            "Sample_03", "Sample_08", "Sample_13", "Sample_42", "Sample_47", "Sample_52", "Sample_29", "Sample_33",
-            "Sample_37", "Sample_68", "Sample_72", "Sample_76", "Sample_17", "Sample_21", "Sample_25", "Sample_56",
-            "Sample_60", "Sample_64", "Sample_04", "Sample_09", "Sample_14", "Sample_43", "Sample_48", "Sample_53",
-            "Sample_30", "Sample_34", "Sample_38", "Sample_69", "Sample_73", "Sample_77", "Sample_18", "Sample_22",
-            "Sample_26", "Sample_57", "Sample_61", "Sample_65", "Sample_05", "Sample_10", "Sample_15", "Sample_44",
-            "Sample_49", "Sample_54", "Sample_31", "Sample_35", "Sample_39", "Sample_70", "Sample_74", "Sample_78",
-            "Sample_19", "Sample_23", "Sample_27", "Sample_58", "Sample_62", "Sample_66"
-        ]
+        new_headers = ['Contig_ID'] + [f'Sample_{str(i).zfill(2)}' for i in range(1, len(header))]
+
+        # Step 3: Reorder the 'Sample_' columns according to the metadata order
+        sample_order = load_sample_order(order_file, order_column)
 
         # Get non-sample columns and sample columns in the given order
         non_sample_columns = ['Contig_ID']
-        sample_columns = [col for col in sample_order if col in df.columns]
+        sample_columns = [col for col in sample_order if col in new_headers]
 
         # Ensure final column order is correct
         final_columns = non_sample_columns + sample_columns
-        df = df[final_columns]
 
-        # Step 4: Filter out rows where Contig_ID is 'Unknown' or ends with 'bam'
-        original_row_count = len(df)
-        df = df[~(df['Contig_ID'].str.lower() == 'unknown') & ~(df['Contig_ID'].str.lower().str.endswith('bam'))]
-        filtered_row_count = len(df)
-        print(f"Filtered out {original_row_count - filtered_row_count} rows")
+        if chunksize is None:
+            # Step 4: Load only the kept columns and filter out 'Unknown' and '*bam' rows
+            df = pd.read_csv(input_file, header=0, names=new_headers, usecols=final_columns)[final_columns]
+            print(f"Loaded {len(df)} rows from {input_file}")
+            original_row_count = len(df)
+            df = filter_rows(df)
+            filtered_row_count = len(df)
+
+            # Step 5: Save the reordered and filtered DataFrame to the output file
+            df.to_csv(output_file, index=False)
+        else:
+            # Step 4: Stream the kept columns as float32, filtering and writing chunk by chunk
+            dtypes = {col: 'float32' for col in sample_columns}
+            dtypes['Contig_ID'] = str
+            reader = pd.read_csv(input_file, header=0, names=new_headers, usecols=final_columns, dtype=dtypes,
+                                 chunksize=chunksize)
+            original_row_count = filtered_row_count = 0
+            with open(output_file, 'w', newline='') as out:
+                # Step 5: Append each reordered and filtered chunk to the output file
+                for i, chunk in enumerate(tqdm(reader, desc="Processing chunks", unit='chunk')):
+                    original_row_count += len(chunk)
+                    chunk = filter_rows(chunk[final_columns])
+                    filtered_row_count += len(chunk)
+                    chunk.to_csv(out, index=False, header=(i == 0))
+            print(f"Loaded {original_row_count} rows from {input_file}")
 
-        # Step 5: Save the reordered and filtered DataFrame to the output file
-        df.to_csv(output_file, index=False)
+        print(f"Filtered out {original_row_count - filtered_row_count} rows")
         print(f"Header renaming, reordering, and filtering completed successfully. Saved {filtered_row_count} rows to {output_file}")
     except Exception as e:
         print(f"Error during processing: {e}")
@@ -52,20 +131,30 @@ def rename_reorder_and_filter(input_file, output_file):
 def main():
     parser = argparse.ArgumentParser(
         description="Rename headers in a CSV file, reorder columns, and filter rows.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
         epilog="""
 Example:
     python script.py -i input.csv -o output.csv
+    python script.py -i input.csv -o output.csv -m Collect/00_Metadata/Sample_Group.csv -c 500000
+    python script.py -i contig_abundance.npz -o output.npz
 
 This will rename the headers in 'input.csv', reorder the 'Sample_' columns as per the specified order,
 filter out rows where Contig_ID is 'Unknown' or ends with 'bam', and save the result to 'output.csv'.
+With -m the order is taken from the rows of the metadata file; with -c the file is streamed in chunks
+with float32 values, so memory stays flat. A sparse .npz input (110 -s) is processed without densifying;
+the output is sparse too if its name ends in .npz.
         """
     )
-    parser.add_argument('-i', '--input', help="Input CSV file path", required=True)
-    parser.add_argument('-o', '--output', help="Output CSV file path", required=True)
+    parser.add_argument('-i', '--input', help="Input CSV file path (or sparse .npz matrix)", required=True)
+    parser.add_argument('-o', '--output', help="Output CSV file path (or sparse .npz matrix)", required=True)
+    parser.add_argument('-m', '--order_file', help="Metadata CSV listing the samples in output order (default: built-in order)")
+    parser.add_argument('--order_column', default='Sample', help="Column of the metadata CSV holding sample names (default: Sample)")
+    parser.add_argument('-c', '--chunksize', type=int, default=None,
+                        help="Stream the input in chunks of this many rows with float32 values (default: load the whole file)")
     
     args = parser.parse_args()
     
-    rename_reorder_and_filter(args.input, args.output)
+    rename_reorder_and_filter(args.input, args.output, args.order_file, args.order_column, args.chunksize)
 
 if __name__ == "__main__":
     main()
@@ -1,50 +1,98 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
 import pandas as pd
 import argparse
+from tqdm import tqdm
+
+# Custom sort orders, applied in this column order; values not listed sort last
+SORT_ORDERS = {
+    'Location': ['HP', 'RS', 'MS', 'BTP'],
+    'Country': ['DK', 'SP', 'UK'],
+    'Contig_Classification': ['Chromosome', 'Plasmid', 'Phage'],
+}
+
+def sort_key(df):
+    """
+    Combine the category codes of the available sort columns into one small integer per row.
+
+    Returns:
+        ndarray: Bucket number of each row; bucket order is the custom sort order
+        int: Number of possible buckets
+    """
+    key = np.zeros(len(df), dtype=np.int64)
+    num_buckets = 1
+    for column, order in SORT_ORDERS.items():
+        if column not in df.columns:
+            continue
+        # Unknown values get code -1, moved after the listed values
+        codes = pd.Index(order).get_indexer(df[column]).astype(np.int64)
+        codes[codes == -1] = len(order)
+        key = key * (len(order) + 1) + codes
+        num_buckets *= len(order) + 1
+    return key, num_buckets
 
 def custom_sort(df):
-    # Define custom sort orders
-    location_order = ['HP', 'RS', 'MS', 'BTP']
-    country_order = ['DK', 'SP', 'UK']
-    classification_order = ['Chromosome', 'Plasmid', 'Phage']
-    
-    # Create sorting keys based on available columns
-    sort_columns = []
-    
-    if 'Location' in df.columns:
-        df['Location_sort'] = pd.Categorical(df['Location'], categories=location_order, ordered=True)
-        sort_columns.append('Location_sort')
-    
-    if 'Country' in df.columns:
-        df['Country_sort'] = pd.Categorical(df['Country'], categories=country_order, ordered=True)
-        sort_columns.append('Country_sort')
-    
-    if 'Contig_Classification' in df.columns:
-        df['Classification_sort'] = pd.Categorical(df['Contig_Classification'], categories=classification_order, ordered=True)
-        sort_columns.append('Classification_sort')
-    
-    # Sort the dataframe
-    df_sorted = df.sort_values(sort_columns)
-    
-    # Remove temporary sorting columns
-    df_sorted = df_sorted.drop(columns=[col for col in df_sorted.columns if col.endswith('_sort')])
-    
-    return df_sorted
+    # Stable counting sort on the bucket numbers (radix sort for small integer types)
+    key, num_buckets = sort_key(df)
+    dtype = np.uint8 if num_buckets <= 256 else np.uint16
+    order = np.argsort(key.astype(dtype), kind='stable')
+    return df.iloc[order]
+
+def external_sort(input_file, output_file, chunksize, temp_dir=None):
+    """
+    Sort a CSV bigger than memory: append each chunk's rows to one file per bucket, then concatenate the buckets.
+
+    Values are kept as text, so the output holds the input rows unchanged.
+    """
+    header = pd.read_csv(input_file, nrows=0).columns
+    with tempfile.TemporaryDirectory(prefix='reorder_group_', dir=temp_dir) as work_dir:
+        # 1. Distribute the rows into bucket files, preserving their input order
+        buckets = {}
+        try:
+            reader = pd.read_csv(input_file, dtype=str, keep_default_na=False, chunksize=chunksize)
+            for chunk in tqdm(reader, desc="Bucketing chunks", unit='chunk'):
+                key, _ = sort_key(chunk)
+                for bucket, part in chunk.groupby(key, sort=False):
+                    if bucket not in buckets:
+                        buckets[bucket] = open(os.path.join(work_dir, f'bucket_{bucket}.csv'), 'w', newline='')
+                    part.to_csv(buckets[bucket], index=False, header=False)
+        finally:
+            for handle in buckets.values():
+                handle.close()
+
+        # 2. Concatenate the bucket files in sort order
+        with open(output_file, 'w', newline='') as out:
+            pd.DataFrame(columns=header).to_csv(out, index=False)
+            for bucket in sorted(buckets):
+                with open(os.path.join(work_dir, f'bucket_{bucket}.csv'), 'r', newline='') as part:
+                    shutil.copyfileobj(part, out, 16 * 1024 * 1024)
 
 def main():
     # Set up argument parser
-    parser = argparse.ArgumentParser(description='Sort a CSV file based on specific column orders.')
+    parser = argparse.ArgumentParser(description='Sort a CSV file based on specific column orders.',
+                                     epilog='Example: %(prog)s -i contigs.csv -o contigs_sorted.csv -c 1000000')
     parser.add_argument('-i', '--input', required=True, help='Input CSV file path')
     parser.add_argument('-o', '--output', required=True, help='Output CSV file path')
+    parser.add_argument('-c', '--chunksize', type=int, default=None,
+                        help='Sort out of memory, reading this many rows at a time (default: load the whole file)')
+    parser.add_argument('--temp_dir', default=None, help='Directory for bucket files (default: system temp dir)')
     args = parser.parse_args()
 
-    # Read the input CSV file
-    df = pd.read_csv(args.input)
+    if args.chunksize:
+        # Bucket the rows on disk and concatenate the buckets
+        external_sort(args.input, args.output, args.chunksize, args.temp_dir)
+    else:
+        # Read the input CSV file
+        df = pd.read_csv(args.input)
 
-    # Apply custom sorting
-    df_sorted = custom_sort(df)
+        # Apply custom sorting
+        df_sorted = custom_sort(df)
 
-    # Save the sorted dataframe to a new CSV file
-    df_sorted.to_csv(args.output, index=False)
+        # Save the sorted dataframe to a new CSV file
+        df_sorted.to_csv(args.output, index=False)
     print(f"Sorted data has been saved to {args.output}")
 
 if __name__ == "__main__":
@@ -1,53 +1,84 @@
+import functools
+
 import pandas as pd
 import argparse
 from tqdm import tqdm
+from sample_names import extract_sample_names_parallel
+
+GROUP_FILE = 'Collect/00_Metadata/Sample_Group.csv'
+
+@functools.lru_cache(maxsize=None)
+def load_group_data(group_file=GROUP_FILE):
+    """
+    Load the sample group table once, indexed by sample code with categorical columns.
+
+    Args:
+        group_file (str): CSV with a 'Sample' column and one column per group attribute
+
+    Returns:
+        DataFrame: Group attributes indexed by 'Sample' (first row wins for repeated samples)
+    """
+    group_data = pd.read_csv(group_file, dtype=str)
+    group_data = group_data.drop_duplicates('Sample').set_index('Sample', drop=False)
+    return group_data.astype('category')
+
+def add_group_columns(data, group_data, sample_name_column):
+    """
+    Append the group columns of each row's sample with a positional lookup.
+
+    The output columns match a left merge of data with the group table on
+    sample_name_column == 'Sample', including the '_x'/'_y' suffixes for shared names.
+    """
+    # 1. Map each sample code to its row in the group table (-1 for unknown samples)
+    rows = group_data.index.get_indexer(data[sample_name_column].astype(object))
+
+    # 2. Build each group column from the category codes of the matched rows
+    group_columns = [col for col in group_data.columns if not (col == 'Sample' and sample_name_column == 'Sample')]
+    data = data.rename(columns={col: f'{col}_x' for col in group_columns if col in data.columns})
+    for col in group_columns:
+        values = group_data[col].array
+        codes = values.codes[rows]
+        codes[rows == -1] = -1
+        name = f'{col}_y' if f'{col}_x' in data.columns else col
+        data[name] = pd.Categorical.from_codes(codes, dtype=values.dtype)
+    return data
+
+def enrich_chunk(data, contig_id_column, sample_name_column, group_data, jobs=1):
+    # Extract sample names with one vectorised regex pass (see sample_names.SAMPLE_ID_PATTERNS)
+    data[sample_name_column] = extract_sample_names_parallel(data[contig_id_column], jobs)
+    return add_group_columns(data, group_data, sample_name_column)
+
+def process_contig_id(input_file_path, output_file_path, contig_id_column='Contig_ID', sample_name_column='Sample_Name',
+                      jobs=1, group_file=GROUP_FILE, chunksize=None):
+    # 1. Load the group data (cached across calls)
+    group_data = load_group_data(group_file)
 
-# Load the actual group data from the file
-group_file_path = 'Collect/00_Metadata/Sample_Group.csv'
-group_data = pd.read_csv(group_file_path)
-
-def process_contig_id(input_file_path, output_file_path, contig_id_column='Contig_ID', sample_name_column='Sample_Name'):
-    # Load the data
-    data = pd.read_csv(input_file_path)
-
-    # Function to extract sample name
-    def extract_sample_name(contig_id):
-        if contig_id.startswith('18097D'):
-            parts = contig_id.split('-')
-            if len(parts) >= 3:
-                number_part = ''.join(filter(str.isdigit, parts[2]))
-                return f'Sample_{int(number_part):02d}'
-        elif contig_id.startswith('DP'):
-            parts = contig_id.split('-')
-            if len(parts) >= 2:
-                number_part = ''.join(filter(str.isdigit, parts[1]))
-                return f'Sample_{int(number_part):02d}'
-        return None
-
-    # Apply the function to create the Sample_Name column
-    tqdm.pandas(desc="Extracting sample names")
-    data[sample_name_column] = data[contig_id_column].progress_apply(extract_sample_name)
-
-    # Merge with the sample group data from the group file
-    merged_data = pd.merge(data, group_data, left_on=sample_name_column, right_on='Sample', how='left')
-
-    # Ensure all original columns are preserved
-    for col in data.columns:
-        if col not in merged_data.columns:
-            merged_data[col] = data[col]
-
-    # Save the processed data
-    merged_data.to_csv(output_file_path, index=False)
+    # 2. Enrich the whole table, or stream it in chunks so memory stays flat
+    if chunksize is None:
+        data = pd.read_csv(input_file_path)
+        enrich_chunk(data, contig_id_column, sample_name_column, group_data, jobs).to_csv(output_file_path, index=False)
+    else:
+        with open(output_file_path, 'w', newline='') as out:
+            reader = pd.read_csv(input_file_path, chunksize=chunksize)
+            for i, chunk in enumerate(tqdm(reader, desc="Enriching chunks", unit='chunk')):
+                chunk = enrich_chunk(chunk, contig_id_column, sample_name_column, group_data, jobs)
+                chunk.to_csv(out, index=False, header=(i == 0))
 
     print(f"Processed data saved to {output_file_path}")
 
 if __name__ == '__main__':
-    parser = argparse.ArgumentParser(description='Process Contig_ID to generate Sample_Name and enrich with sample group info')
+    parser = argparse.ArgumentParser(description='Process Contig_ID to generate Sample_Name and enrich with sample group info',
+                                     epilog='Example: %(prog)s -i contigs.csv -o contigs_group.csv --chunksize 1000000')
     parser.add_argument('-i', '--input_file', type=str, required=True, help='Path to the input CSV file')
     parser.add_argument('-o', '--output_file', type=str, required=True, help='Path to save the processed CSV file')
     parser.add_argument('--contig_id_column', type=str, default='Contig_ID', help='Name of the column containing Contig_ID')
     parser.add_argument('--sample_name_column', type=str, default='Sample', help='Name of the new column to create for sample names')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of processes for sample name extraction (default: 1)')
+    parser.add_argument('-g', '--group_file', type=str, default=GROUP_FILE, help=f'Path to the sample group CSV (default: {GROUP_FILE})')
+    parser.add_argument('-c', '--chunksize', type=int, default=None,
+                        help='Stream the input in chunks of this many rows (default: load the whole file)')
 
     args = parser.parse_args()
 
-    process_contig_id(args.input_file, args.output_file, args.contig_id_column, args.sample_name_column)
+    process_contig_id(args.input_file, args.output_file, args.contig_id_column, args.sample_name_column, args.jobs,
+                      args.group_file, args.chunksize)
@@ -3,21 +3,16 @@ import subprocess
 import os
 from tqdm import tqdm
 import glob
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pipeline import run_pipeline
+from memory_size import parse_memory
+from bam_sort import SORT_MEMORY_FRACTION
 
-# Setting up argument parser
-parser = argparse.ArgumentParser(description="""Batch BWA MEM script.
-Example usage: python batch_bwa_mem.py -i /path/to/fastq_dir -p prefix -o /path/to/output_dir""",
-formatter_class=argparse.RawTextHelpFormatter)
-parser.add_argument('-i', '--input', help='Input directory containing fastq.gz files. Example: -i /path/to/fastq', required=True)
-parser.add_argument('-p', '--prefix', help='Prefix for rep_seq.fasta. Example: -p prefix', required=True)
-parser.add_argument('-o', '--output', help='Output directory. Example: -o /path/to/output', required=True)
-parser.add_argument('-t', '--threads', help='Number of threads. Example: -t 8', default='8', type=str)
-
-args = parser.parse_args()
-
-# Ensure output directory exists
-bwa_output_dir = os.path.join(args.output, 'bwa')
-os.makedirs(bwa_output_dir, exist_ok=True)
+# bwa mem stops scaling well beyond this many threads per sample
+MAX_BWA_THREADS = 16
+# In the fused pipe, samtools sort gets this share of a job's threads and bwa mem the rest
+SORT_THREAD_DIVISOR = 4
+BWA_INDEX_SUFFIXES = ('.amb', '.ann', '.bwt', '.pac', '.sa')
 
 # Function to find fastq.gz file pairs
 def find_fastq_pairs(directory):
@@ -31,19 +26,159 @@ def find_fastq_pairs(directory):
             paired_files[base_name] = [file]
     return [tuple(sorted(pairs)) for pairs in paired_files.values() if len(pairs) == 2]
 
+# Function to order fastq pairs largest first, so the longest alignments start early
+def sort_pairs_by_size(fastq_pairs):
+    return sorted(fastq_pairs, key=lambda pair: sum(os.path.getsize(f) for f in pair), reverse=True)
+
+# Function to check for the bwa index of the reference and build it once if missing
+def ensure_bwa_index(prefix):
+    fasta_file = f"{prefix}_rep_seq.fasta"
+    if all(os.path.exists(fasta_file + suffix) for suffix in BWA_INDEX_SUFFIXES):
+        return
+    if not os.path.exists(fasta_file):
+        raise FileNotFoundError(f"Reference {fasta_file} not found")
+    print(f"Building bwa index for {fasta_file}")
+    subprocess.run(['bwa', 'index', fasta_file], check=True)
+
+# Function to split the core budget between concurrent samples
+def plan_jobs(total_cores, jobs=None):
+    """Return (jobs, threads per job); by default one job per MAX_BWA_THREADS cores."""
+    if not jobs:
+        jobs = max(1, total_cores // MAX_BWA_THREADS)
+    return jobs, max(1, total_cores // jobs)
+
+# Function to split one job's threads between bwa mem and samtools sort in the fused pipe
+def split_threads(threads):
+    """Return (bwa threads, sort threads); they add up to threads, except that each gets at least 1."""
+    threads = int(threads)
+    sort_threads = max(1, threads // SORT_THREAD_DIVISOR)
+    return max(1, threads - sort_threads), sort_threads
+
+# Function to fit the samtools sort buffers of all concurrent jobs into a memory cap
+def plan_sort_memory(jobs, sort_threads, sort_memory, max_memory=None):
+    """
+    Return the -m value per sort thread; peak sort memory is about jobs x sort threads x -m.
+
+    With max_memory, -m is lowered (never raised) so that the peak stays within
+    SORT_MEMORY_FRACTION of it, leaving room for samtools' own overhead.
+    """
+    if not max_memory:
+        return sort_memory
+    cap = int(parse_memory(max_memory) * SORT_MEMORY_FRACTION / (jobs * sort_threads))
+    return f"{max(1, min(parse_memory(sort_memory), cap) // 1024 ** 2)}M"
+
 # Function to run bwa mem command
 def run_bwa_mem(prefix, fastq1, fastq2, output_dir, threads):
     fasta_file = f"{prefix}_rep_seq.fasta"
     output_file = os.path.join(output_dir, os.path.basename(fastq1).replace('_qc_1.fastq.gz', '.sam'))
-    cmd = ['bwa', 'mem', '-M', '-t', threads, fasta_file, fastq1, fastq2, '>', output_file]
+    cmd = ['bwa', 'mem', '-M', '-t', str(threads), fasta_file, fastq1, fastq2]
     try:
-        subprocess.run(' '.join(cmd), shell=True, check=True)
+        with open(output_file, 'w') as sam:
+            subprocess.run(cmd, stdout=sam, check=True)
         print(f"Successfully processed {fastq1} and {fastq2}")
     except subprocess.CalledProcessError as e:
         print(f"Error processing {fastq1} and {fastq2}: {e}")
 
+# Function to align a fastq pair straight into a sorted BAM (bwa mem | samtools view | samtools sort)
+def run_bwa_sort(prefix, fastq1, fastq2, output_dir, threads, sort_order='coordinate', sort_memory='768M', temp_dir=None):
+    """
+    Align one fastq pair and write only the final sorted BAM (and its index for coordinate order).
+
+    The job's threads are split between the stages (split_threads), so the pipe
+    starts no more threads than it was given.
+
+    Args:
+        threads (int): Threads for the whole pipe
+        sort_order (str): 'coordinate' (indexed while sorting) or 'name' (samtools sort -n)
+        sort_memory (str): Memory per samtools sort thread, e.g. '2G'
+        temp_dir (str): Directory for samtools sort temporary files (default: output_dir)
+
+    Returns:
+        bool: True if every stage of the pipe succeeded
+    """
+    fasta_file = f"{prefix}_rep_seq.fasta"
+    sample = os.path.basename(fastq1).replace('_qc_1.fastq.gz', '')
+    output_file = os.path.join(output_dir, f"{sample}_sort.bam")
+    temp_prefix = os.path.join(temp_dir or output_dir, f"{sample}.sort_tmp")
+
+    bwa_threads, sort_threads = split_threads(threads)
+    sort_cmd = ['samtools', 'sort', '-@', str(sort_threads), '-m', sort_memory, '-T', temp_prefix]
+    outputs = [output_file]
+    if sort_order == 'name':
+        sort_cmd += ['-n', '-o', output_file, '-']
+    else:
+        outputs.append(f"{output_file}.bai")
+        sort_cmd += ['--write-index', '-o', f"{output_file}##idx##{output_file}.bai", '-']
+
+    commands = [
+        ['bwa', 'mem', '-M', '-t', str(bwa_threads), fasta_file, fastq1, fastq2],
+        ['samtools', 'view', '-u', '-'],
+        sort_cmd,
+    ]
+    try:
+        run_pipeline(commands, outputs)
+        print(f"Successfully aligned and sorted {fastq1} and {fastq2} to {output_file}")
+        return True
+    except (subprocess.CalledProcessError, OSError) as e:
+        print(f"Error processing {fastq1} and {fastq2}: {e}")
+        return False
+
 # Main script execution
 if __name__ == '__main__':
-    fastq_pairs = find_fastq_pairs(args.input)
-    for fastq1, fastq2 in tqdm(fastq_pairs, desc="Processing fastq file pairs"):
-        run_bwa_mem(args.prefix, fastq1, fastq2, bwa_output_dir, args.threads)
+    # Setting up argument parser
+    parser = argparse.ArgumentParser(description="""Batch BWA MEM script.
+Example usage: python batch_bwa_mem.py -i /path/to/fastq_dir -p prefix -o /path/to/output_dir
+Sorted BAM output: python batch_bwa_mem.py -i /path/to/fastq_dir -p prefix -o /path/to/output_dir -s coordinate
+Concurrent samples: python batch_bwa_mem.py -i /path/to/fastq_dir -p prefix -o /path/to/output_dir --total-cores 128 -j 8""",
+    formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('-i', '--input', help='Input directory containing fastq.gz files. Example: -i /path/to/fastq', required=True)
+    parser.add_argument('-p', '--prefix', help='Prefix for rep_seq.fasta. Example: -p prefix', required=True)
+    parser.add_argument('-o', '--output', help='Output directory. Example: -o /path/to/output', required=True)
+    parser.add_argument('-t', '--threads', help='Number of threads. Example: -t 8', default='8', type=str)
+    parser.add_argument('-s', '--sort', choices=['coordinate', 'name'], default=None,
+                        help='Pipe bwa into samtools view and sort, writing only {sample}_sort.bam\n'
+                             '(plus .bai for coordinate order) instead of SAM files. Example: -s coordinate')
+    parser.add_argument('--total-cores', type=int, default=None,
+                        help='Cores shared by all concurrent samples; threads per sample = total / jobs. Example: --total-cores 128')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help=f'Samples aligned at once (default: total cores / {MAX_BWA_THREADS}, or 1 without --total-cores)')
+    parser.add_argument('-m', '--sort_memory', default='768M',
+                        help='Memory per samtools sort thread (default: 768M).\n'
+                             'Peak sort memory is about jobs x sort threads (threads / 4) x this value')
+    parser.add_argument('--max_sort_memory', default=None,
+                        help='Cap on the sort memory of all concurrent samples; lowers -m to fit. Example: --max_sort_memory 64G')
+    parser.add_argument('--temp_dir', default=None, help='Directory for samtools sort temporary files (default: output directory)')
+
+    args = parser.parse_args()
+
+    # Ensure output directory exists
+    bwa_output_dir = os.path.join(args.output, 'bwa')
+    os.makedirs(bwa_output_dir, exist_ok=True)
+
+    # Check the reference index once before any alignment starts
+    ensure_bwa_index(args.prefix)
+
+    # Split the cores between concurrent samples, or run one sample at a time with -t threads
+    if args.total_cores:
+        jobs, threads = plan_jobs(args.total_cores, args.jobs)
+    else:
+        jobs, threads = args.jobs or 1, args.threads
+    print(f"Running {jobs} sample(s) at a time with {threads} threads each")
+    if args.sort:
+        bwa_threads, sort_threads = split_threads(threads)
+        sort_memory = plan_sort_memory(jobs, sort_threads, args.sort_memory, args.max_sort_memory)
+        peak = jobs * sort_threads * parse_memory(sort_memory) / 1024 ** 3
+        print(f"Each pipe: bwa mem -t {bwa_threads}, samtools sort -@ {sort_threads} -m {sort_memory}; "
+              f"peak sort memory about {peak:.1f}G")
+
+    def align(pair):
+        fastq1, fastq2 = pair
+        if args.sort:
+            return run_bwa_sort(args.prefix, fastq1, fastq2, bwa_output_dir, threads, args.sort, sort_memory, args.temp_dir)
+        return run_bwa_mem(args.prefix, fastq1, fastq2, bwa_output_dir, threads)
+
+    fastq_pairs = sort_pairs_by_size(find_fastq_pairs(args.input))
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(align, pair) for pair in fastq_pairs]
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Processing fastq file pairs"):
+            future.result()
@@ -0,0 +1,134 @@
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from tqdm import tqdm
+from pipeline import run_pipeline, run_parallel
+from job_ledger import JobLedger, atomic_outputs, partial_path, remove_partial_dirs
+
+# Best-hit filter options of 106_bam_filter.py
+FILTER_OPTIONS = ['-b', '-l', '0', '-p', '0', '-z', '0', '--besthit']
+
+def sample_name(path):
+    """'S1.sam' and 'S1_sort.bam' (bwa output of 103, optionally sorted) both give 'S1'."""
+    name = path.stem
+    return name[:-len('_sort')] if name.endswith('_sort') else name
+
+def find_alignments(input_dir):
+    """Alignment files of the input directory, largest first so the longest samples start early."""
+    files = [f for f in Path(input_dir).iterdir() if f.suffix in ('.sam', '.bam')]
+    return sorted(files, key=lambda f: f.stat().st_size, reverse=True)
+
+def quantify_sample(alignment, output_dir, threads=4, sort_memory='768M', unit='fpkm', name_sorted=False,
+                    keep_bam=False, remove_input=False, temp_dir=None, ledger=None):
+    """
+    Run 104-108 for one sample: name sort, best-hit filter, then profile and coverage.
+
+    The sort streams straight into msamtools filter, so neither the BAM nor the sorted
+    BAM of 104/105 is written. The filtered BAM is written once, read by profile and
+    coverage at the same time, then deleted unless keep_bam is set.
+
+    Args:
+        alignment (Path): SAM or BAM file of one sample (from 103)
+        output_dir (Path): Base directory for the 'filter', 'profile' and 'coverage' outputs
+        threads (int): samtools sort threads
+        sort_memory (str): Memory per samtools sort thread, e.g. '2G'
+        unit (str): Profile unit, 'fpkm' or 'tpm'
+        name_sorted (bool): Input is already sorted by read name (103 -s name), skip the sort
+        keep_bam (bool): Keep the filtered BAM
+        remove_input (bool): Delete the input alignment once the sample has finished
+        temp_dir (str): Directory for samtools sort temporary files (default: output_dir/filter)
+        ledger (JobLedger): Records finished samples; samples already done from the same input are skipped
+
+    Returns:
+        bool: True if every step succeeded
+    """
+    sample = sample_name(alignment)
+    stem = f"{sample}_sort_filter"
+    filter_file = output_dir / 'filter' / f"{stem}.bam"
+    profile_file = output_dir / 'profile' / f"{stem}_profile_rb.txt.gz"
+    coverage_file = output_dir / 'coverage' / f"{stem}_coverage_info.txt.gz"
+    temp_prefix = Path(temp_dir or output_dir / 'filter') / f"{sample}.sort_tmp"
+
+    params = {'unit': unit, 'name_sorted': name_sorted}
+    if ledger is not None and ledger.is_done([profile_file, coverage_file], [alignment], params):
+        print(f'Skipping {alignment.name}, output is up to date.')
+        return True
+
+    # The filtered BAM is only renamed into place when it is kept
+    filter_temp = partial_path(filter_file)
+    outputs = [profile_file, coverage_file] + ([filter_file] if keep_bam else [])
+    try:
+        with atomic_outputs(*outputs) as temps:
+            profile_temp, coverage_temp = temps[:2]
+            # 1. Sort by read name (104 + 105) and stream into the best-hit filter (106)
+            if name_sorted:
+                commands = [['msamtools', 'filter', *FILTER_OPTIONS, alignment]]
+            else:
+                commands = [['samtools', 'sort', '-n', '-@', threads, '-m', sort_memory, '-T', temp_prefix, '-O', 'bam', '-o', '-', alignment],
+                            ['msamtools', 'filter', *FILTER_OPTIONS, '-']]
+            run_pipeline(commands, [filter_temp], stdout=filter_temp)
+
+            # 2. Profile (107) and coverage (108) read the filtered BAM concurrently
+            run_parallel([
+                ['msamtools', 'profile', '--multi=all', f'--unit={unit}', f'--label={filter_file.name}', '-o', profile_temp, filter_temp],
+                ['msamtools', 'coverage', '-z', '--summary', '-o', coverage_temp, filter_temp],
+            ], [profile_temp, coverage_temp])
+
+            # 3. Delete intermediates as soon as their consumers have finished
+            if not keep_bam:
+                filter_temp.unlink()
+        if ledger is not None:
+            ledger.record([profile_file, coverage_file], [alignment], params)
+        if remove_input:
+            alignment.unlink()
+        print(f'Quantified {alignment.name} into {profile_file} and {coverage_file}')
+        return True
+    except (subprocess.CalledProcessError, OSError) as e:
+        if filter_temp.exists():
+            filter_temp.unlink()
+        remove_partial_dirs([filter_temp])
+        print(f"Error processing {alignment}: {e}")
+        return False
+
+def quantify_samples(input_dir, output_dir, jobs=4, threads=4, force=False, **options):
+    output_dir = Path(output_dir)
+    for sub_dir in ('filter', 'profile', 'coverage'):
+        (output_dir / sub_dir).mkdir(parents=True, exist_ok=True)
+    ledger = JobLedger(output_dir, force)
+
+    alignments = find_alignments(input_dir)
+    successful = failed = 0
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(quantify_sample, alignment, output_dir, threads, ledger=ledger, **options) for alignment in alignments]
+        for future in tqdm(as_completed(futures), total=len(futures), desc='Quantifying samples'):
+            if future.result():
+                successful += 1
+            else:
+                failed += 1
+    return successful, failed
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run 104-108 (SAM to BAM, name sort, best-hit filter, profile, coverage) '
+                                                 'for each sample in one pass, several samples at a time.',
+                                     epilog='Example: python script.py -i /path/to/bwa -o /path/to/quantification -j 8 -t 4 -u fpkm')
+    parser.add_argument('-i', '--input', required=True, help='Input directory containing SAM or BAM files from 103')
+    parser.add_argument('-o', '--output', required=True, help='Output directory; profiles and coverage go to its profile/ and coverage/ folders')
+    parser.add_argument('-j', '--jobs', type=int, default=4, help='Number of samples processed at once (default: 4)')
+    parser.add_argument('-t', '--threads', type=int, default=4, help='samtools sort threads per sample (default: 4)')
+    parser.add_argument('-m', '--sort_memory', default='768M', help='Memory per samtools sort thread (default: 768M)')
+    parser.add_argument('-u', '--unit', choices=['fpkm', 'tpm'], default='fpkm', help='Profile unit (default: fpkm)')
+    parser.add_argument('--name_sorted', action='store_true', help='Inputs are already sorted by read name (103 -s name)')
+    parser.add_argument('--keep_bam', action='store_true', help='Keep the filtered BAM files in the filter/ folder')
+    parser.add_argument('--remove_input', action='store_true', help='Delete each input SAM/BAM once its sample has finished')
+    parser.add_argument('--force', action='store_true', help='Redo samples even if their outputs are up to date')
+    parser.add_argument('--temp_dir', default=None, help='Directory for samtools sort temporary files (default: output filter/ folder)')
+    args = parser.parse_args()
+
+    try:
+        successful, failed = quantify_samples(args.input, args.output, args.jobs, args.threads, args.force,
+                                              sort_memory=args.sort_memory, unit=args.unit, name_sorted=args.name_sorted,
+                                              keep_bam=args.keep_bam, remove_input=args.remove_input, temp_dir=args.temp_dir)
+        print(f"Processing completed. Successful: {successful}, Failed: {failed}")
+    except Exception as e:
+        print(f"Error during processing: {e}")
@@ -2,27 +2,37 @@ import argparse
 import subprocess
 from pathlib import Path
 from tqdm import tqdm
+from job_ledger import JobLedger, atomic_outputs
 
-def convert_sam_to_bam(input_dir, output_dir):
+def convert_sam_to_bam(input_dir, output_dir, force=False):
     input_dir = Path(input_dir)
     output_dir = Path(output_dir)
     output_dir.mkdir(parents=True, exist_ok=True)
+    ledger = JobLedger(output_dir, force)
 
     sam_files = list(input_dir.glob('*.sam'))
     for sam_file in tqdm(sam_files, desc='Converting SAM to BAM'):
         output_file = output_dir / sam_file.with_suffix('.bam').name
-        subprocess.run(['samtools', 'view', '-Sb', sam_file, '-o', output_file], check=True)
+        # Skip samples whose SAM is unchanged since their BAM was written
+        if ledger.is_done([output_file], [sam_file]):
+            print(f'Skipping {sam_file.name}, output is up to date.')
+            continue
+        with atomic_outputs(output_file) as temp_file:
+            subprocess.run(['samtools', 'view', '-Sb', sam_file, '-o', temp_file], check=True)
+        ledger.record([output_file], [sam_file])
         print(f'Converted {sam_file} to {output_file}')
 
 if __name__ == '__main__':
-    parser = argparse.ArgumentParser(description='Convert SAM files to BAM format using samtools.',
+    parser = argparse.ArgumentParser(description='Convert SAM files to BAM format using samtools. '
+                                                 'Finished samples are recorded in the output directory and skipped on rerun.',
                                      epilog='Example: python script.py -i /path/to/sam_files -o /path/to/bam_files')
     parser.add_argument('-i', '--input', required=True, help='Input directory containing SAM files')
     parser.add_argument('-o', '--output', required=True, help='Output directory for BAM files')
+    parser.add_argument('--force', action='store_true', help='Redo samples even if their outputs are up to date')
     args = parser.parse_args()
 
     try:
-        convert_sam_to_bam(args.input, args.output)
+        convert_sam_to_bam(args.input, args.output, args.force)
         print("Conversion completed successfully.")
     except Exception as e:
         print(f"Error during conversion: {e}")
@@ -1,29 +1,33 @@
 import argparse
-import subprocess
 from pathlib import Path
-from tqdm import tqdm
+from bam_sort import run_sort_jobs
 
-def sort_bam_files(input_dir, output_dir, threads):
+def sort_bam_files(input_dir, output_dir, threads, memory='8G', jobs=None, temp_dir=None, force=False):
     input_dir = Path(input_dir)
     output_dir = Path(output_dir)
     output_dir.mkdir(parents=True, exist_ok=True)
 
     bam_files = list(input_dir.glob('*.bam'))
-    for bam_file in tqdm(bam_files, desc='Sorting BAM files'):
-        output_file = output_dir / (bam_file.stem + '_sort.bam')
-        subprocess.run(['samtools', 'sort', '-n', '-@', str(threads), str(bam_file), '-o', str(output_file)], check=True)
-        print(f'Sorted {bam_file} to {output_file}')
+
+    # Sort several BAM files by read name at once, splitting threads and memory between them
+    successful, failed = run_sort_jobs(bam_files, output_dir, memory, threads, jobs, by_name=True, temp_dir=temp_dir, force=force)
+    if failed:
+        raise RuntimeError(f'{failed} of {successful + failed} BAM files failed to sort')
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Sort BAM files using samtools.',
-                                     epilog='Example: python script.py -i /path/to/bam_files -o /path/to/sorted_bam_files -t 8')
+                                     epilog='Example: python script.py -i /path/to/bam_files -o /path/to/sorted_bam_files -t 32 -m 64G --temp_dir /scratch/tmp')
     parser.add_argument('-i', '--input', required=True, help='Input directory containing BAM files')
     parser.add_argument('-o', '--output', required=True, help='Output directory for sorted BAM files')
-    parser.add_argument('-t', '--threads', type=int, default=8, help='Number of threads to use (default: 8)')
+    parser.add_argument('-t', '--threads', type=int, default=8, help='Total number of threads shared by all sorts (default: 8)')
+    parser.add_argument('-m', '--memory', default='8G', help='Total memory shared by all sorts, e.g. 64G (default: 8G)')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='Number of BAM files sorted at once (default: one per 4 threads)')
+    parser.add_argument('--force', action='store_true', help='Redo files even if their outputs are up to date')
+    parser.add_argument('--temp_dir', default=None, help='Local scratch directory for samtools temporary files (default: output directory)')
     args = parser.parse_args()
 
     try:
-        sort_bam_files(args.input, args.output, args.threads)
+        sort_bam_files(args.input, args.output, args.threads, args.memory, args.jobs, args.temp_dir, args.force)
         print("Sorting completed successfully.")
     except Exception as e:
         print(f"Error during sorting: {e}")
@@ -1,30 +1,171 @@
 import argparse
+import os
 import subprocess
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 from tqdm import tqdm
+from job_ledger import JobLedger, atomic_outputs
 
-def filter_bam_files(input_dir, output_dir):
+def msamtools_filter(bam_file, output_file, length=0, identity=0, coverage=0):
+    # msamtools reads and writes single-threaded; stdout goes straight to the output file
+    cmd = ['msamtools', 'filter', '-b', '-l', str(length), '-p', f'{identity:g}', '-z', f'{coverage:g}', '--besthit', str(bam_file)]
+    with open(output_file, 'wb') as out:
+        subprocess.run(cmd, stdout=out, check=True)
+
+def alignment_stats(read):
+    """
+    Return (aligned length, matches, percent of the read aligned) of one alignment.
+
+    Aligned length counts M/I/D/=/X columns, matches are aligned length minus the NM
+    edit distance, and the read length includes soft and hard clips.
+    """
+    aligned_length = sum(n for op, n in read.cigartuples if op in (0, 1, 2, 7, 8))
+    matches = aligned_length - (read.get_tag('NM') if read.has_tag('NM') else 0)
+    read_length = read.infer_read_length() or 1
+    return aligned_length, matches, 100.0 * read.query_alignment_length / read_length
+
+def best_hits(group, length, identity, coverage):
+    """Keep the alignments of one read (mate) passing the thresholds with the most matching bases."""
+    passed = []
+    for read in group:
+        if read.is_unmapped or not read.cigartuples:
+            continue
+        aligned_length, matches, percent_aligned = alignment_stats(read)
+        percent_identity = 100.0 * matches / aligned_length if aligned_length else 0.0
+        if aligned_length >= length and percent_identity >= identity and percent_aligned >= coverage:
+            passed.append((matches, read))
+    if not passed:
+        return []
+    best = max(matches for matches, _ in passed)
+    return [read for matches, read in passed if matches == best]
+
+def pysam_filter(bam_file, output_file, length=0, identity=0, coverage=0, threads=2):
+    """
+    Best-hit filter with pysam: stream reads grouped by name, keep the best alignments of each mate.
+
+    The input must be sorted or grouped by read name (as for msamtools). BGZF
+    decompression and compression each use `threads` threads.
+
+    Returns:
+        tuple: (alignments read, alignments written)
+    """
+    import pysam
+
+    read_count = written = 0
+    with pysam.AlignmentFile(str(bam_file), 'rb', threads=threads) as bam, \
+            pysam.AlignmentFile(str(output_file), 'wb', template=bam, threads=threads) as out:
+        def flush(group):
+            # Mates are filtered separately; output keeps the input order of the kept records
+            keep = set()
+            for mate in (1, 2, 0):
+                reads = [r for r in group if (r.is_read1 and mate == 1) or (r.is_read2 and mate == 2)
+                         or (mate == 0 and not r.is_read1 and not r.is_read2)]
+                keep.update(id(r) for r in best_hits(reads, length, identity, coverage))
+            kept = [r for r in group if id(r) in keep]
+            for r in kept:
+                out.write(r)
+            return len(kept)
+
+        group, name = [], None
+        for read in bam.fetch(until_eof=True):
+            read_count += 1
+            if read.query_name != name and group:
+                written += flush(group)
+                group = []
+            name = read.query_name
+            group.append(read)
+        if group:
+            written += flush(group)
+    return read_count, written
+
+def compare_engines(bam_file, length=0, identity=0, coverage=0, threads=2):
+    """Run msamtools and pysam on one BAM and report whether they keep the same alignments."""
+    import pysam
+
+    def records(path):
+        with pysam.AlignmentFile(path, 'rb', threads=threads) as bam:
+            return [(r.query_name, r.flag, r.reference_name, r.reference_start, r.cigarstring)
+                    for r in bam.fetch(until_eof=True)]
+
+    with tempfile.TemporaryDirectory(prefix='bam_filter_') as work_dir:
+        expected = os.path.join(work_dir, 'msamtools.bam')
+        actual = os.path.join(work_dir, 'pysam.bam')
+        msamtools_filter(bam_file, expected, length, identity, coverage)
+        pysam_filter(bam_file, actual, length, identity, coverage, threads)
+        expected, actual = records(expected), records(actual)
+    missing = set(expected) - set(actual)
+    extra = set(actual) - set(expected)
+    if missing or extra:
+        print(f'{bam_file}: MISMATCH, {len(missing)} alignments only in msamtools, {len(extra)} only in pysam')
+        for record in sorted(missing)[:5]:
+            print(f'  msamtools only: {record}')
+        for record in sorted(extra)[:5]:
+            print(f'  pysam only: {record}')
+        return False
+    print(f'{bam_file}: identical, {len(actual)} alignments kept by both engines')
+    return True
+
+def filter_bam_file(bam_file, output_file, engine='msamtools', length=0, identity=0, coverage=0, threads=2):
+    # Write under a temporary name, renamed into place only when complete
+    with atomic_outputs(output_file) as temp_file:
+        if engine == 'pysam':
+            pysam_filter(bam_file, temp_file, length, identity, coverage, threads)
+        else:
+            msamtools_filter(bam_file, temp_file, length, identity, coverage)
+    return bam_file, output_file
+
+def filter_bam_files(input_dir, output_dir, engine='msamtools', length=0, identity=0, coverage=0, jobs=1, threads=2, force=False):
     input_dir = Path(input_dir)
     output_dir = Path(output_dir)
     output_dir.mkdir(parents=True, exist_ok=True)
+    ledger = JobLedger(output_dir, force)
+    params = {'engine': engine, 'length': length, 'identity': identity, 'coverage': coverage}
 
-    sorted_bam_files = list(input_dir.glob('*_sort.bam'))
-    for bam_file in tqdm(sorted_bam_files, desc='Filtering BAM files'):
+    # Skip files already filtered from unchanged inputs with the same thresholds
+    todo = []
+    for bam_file in input_dir.glob('*_sort.bam'):
         output_file = output_dir / (bam_file.stem + '_filter.bam')
-        cmd = ['msamtools', 'filter', '-b', '-l', '0', '-p', '0', '-z', '0', '--besthit', str(bam_file), '>', str(output_file)]
-        cmd_string = " ".join(cmd)
-        subprocess.run(cmd_string, shell=True, check=True)
-        print(f'Filtered {bam_file} to {output_file}')
+        if ledger.is_done([output_file], [bam_file], params):
+            print(f'Skipping {bam_file.name}, output is up to date.')
+        else:
+            todo.append((bam_file, output_file))
+
+    # Filter several files at once, each in its own process
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(filter_bam_file, bam_file, output_file, engine, length, identity, coverage, threads)
+                   for bam_file, output_file in todo]
+        for future in tqdm(as_completed(futures), total=len(futures), desc='Filtering BAM files'):
+            bam_file, output_file = future.result()
+            ledger.record([output_file], [bam_file], params)
+            print(f'Filtered {bam_file} to {output_file}')
 
 if __name__ == '__main__':
-    parser = argparse.ArgumentParser(description='Filter sorted BAM files using msamtools.',
-                                     epilog='Example: python script.py -i /path/to/sorted_bam_files -o /path/to/filtered_bam_files')
+    parser = argparse.ArgumentParser(description='Filter sorted BAM files using msamtools, or the built-in pysam best-hit filter.',
+                                     epilog='Example: python script.py -i /path/to/sorted_bam_files -o /path/to/filtered_bam_files -e pysam -j 8 -t 4')
     parser.add_argument('-i', '--input', required=True, help='Input directory containing sorted BAM files')
     parser.add_argument('-o', '--output', required=True, help='Output directory for filtered BAM files')
+    parser.add_argument('-e', '--engine', choices=['msamtools', 'pysam'], default='msamtools',
+                        help='msamtools filter, or the pysam reimplementation with multi-threaded BGZF (default: msamtools)')
+    parser.add_argument('-l', '--length', type=int, default=0, help='Min. aligned length (default: 0)')
+    parser.add_argument('-p', '--identity', type=float, default=0, help='Min. percent identity of the alignment (default: 0)')
+    parser.add_argument('-z', '--coverage', type=float, default=0, help='Min. percent of the read aligned (default: 0)')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of BAM files filtered at once (default: 1)')
+    parser.add_argument('-t', '--threads', type=int, default=2, help='BGZF threads per file for the pysam engine (default: 2)')
+    parser.add_argument('--force', action='store_true', help='Redo files even if their outputs are up to date')
+    parser.add_argument('--compare', action='store_true',
+                        help='Run both engines on every input BAM and report differences instead of writing output')
     args = parser.parse_args()
 
     try:
-        filter_bam_files(args.input, args.output)
-        print("Filtering completed successfully.")
+        if args.compare:
+            bam_files = sorted(Path(args.input).glob('*_sort.bam'))
+            identical = sum(compare_engines(bam_file, args.length, args.identity, args.coverage, args.threads)
+                            for bam_file in tqdm(bam_files, desc='Comparing engines'))
+            print(f"Comparison completed. Identical: {identical}, Different: {len(bam_files) - identical}")
+        else:
+            filter_bam_files(args.input, args.output, args.engine, args.length, args.identity, args.coverage,
+                             args.jobs, args.threads, args.force)
+            print("Filtering completed successfully.")
     except Exception as e:
         print(f"Error during filtering: {e}")
@@ -2,17 +2,25 @@ import argparse
 import subprocess
 from pathlib import Path
 from tqdm import tqdm
+from job_ledger import JobLedger, atomic_outputs
 
-def profile_bam_files(input_dir, output_dir):
+def profile_bam_files(input_dir, output_dir, force=False):
     input_dir = Path(input_dir)
     output_dir = Path(output_dir)
     output_dir.mkdir(parents=True, exist_ok=True)
+    ledger = JobLedger(output_dir, force)
+    params = {'unit': 'fpkm', 'multi': 'all'}
 
     filter_bam_files = list(input_dir.glob('*_sort_filter.bam'))
     for bam_file in tqdm(filter_bam_files, desc='Generating profiles from BAM files'):
         output_file = output_dir / (bam_file.stem + '_profile_rb.txt.gz')
-        cmd = ['msamtools', 'profile', '--multi=all', '--unit=fpkm', '--label=' + bam_file.name, '-o', str(output_file), str(bam_file)]
-        subprocess.run(cmd, check=True)
+        if ledger.is_done([output_file], [bam_file], params):
+            print(f'Skipping {bam_file.name}, output is up to date.')
+            continue
+        with atomic_outputs(output_file) as temp_file:
+            cmd = ['msamtools', 'profile', '--multi=all', '--unit=fpkm', '--label=' + bam_file.name, '-o', str(temp_file), str(bam_file)]
+            subprocess.run(cmd, check=True)
+        ledger.record([output_file], [bam_file], params)
         print(f'Generated profile for {bam_file} into {output_file}')
 
 if __name__ == '__main__':
@@ -20,10 +28,11 @@ if __name__ == '__main__':
                                      epilog='Example: python script.py -i /path/to/filtered_bam_files -o /path/to/profile_output')
     parser.add_argument('-i', '--input', required=True, help='Input directory containing filtered BAM files')
     parser.add_argument('-o', '--output', required=True, help='Output directory for profile text files')
+    parser.add_argument('--force', action='store_true', help='Redo files even if their outputs are up to date')
     args = parser.parse_args()
 
     try:
-        profile_bam_files(args.input, args.output)
+        profile_bam_files(args.input, args.output, args.force)
         print("Profile generation completed successfully.")
     except Exception as e:
         print(f"Error during profile generation: {e}")
@@ -0,0 +1,199 @@
+import argparse
+import gzip
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+from tqdm import tqdm
+from job_ledger import JobLedger, atomic_outputs
+
+UNITS = ['count', 'ab', 'rel', 'fpkm', 'tpm', 'rpkm']
+# Records buffered before their (insert, contig) pairs are counted
+BLOCK_RECORDS = 1_000_000
+
+def count_hits(fragments, mates, tids, num_contigs):
+    """Count each insert and each read once per contig it hits (msamtools --multi=all)."""
+    fragment_pairs = np.unique(fragments * num_contigs + tids)
+    read_pairs = np.unique((fragments * 2 + mates) * num_contigs + tids)
+    return (np.bincount(fragment_pairs % num_contigs, minlength=num_contigs),
+            np.bincount(read_pairs % num_contigs, minlength=num_contigs),
+            len(np.unique(fragments)), len(np.unique(fragments * 2 + mates)))
+
+def count_bam(bam_file, threads=2):
+    """
+    Read a name-grouped BAM once and count inserts and reads per contig.
+
+    Returns:
+        tuple: (contig names, contig lengths, insert counts, read counts, mapped inserts, mapped reads,
+                unmapped inserts, unmapped reads)
+    """
+    import pysam
+
+    with pysam.AlignmentFile(str(bam_file), 'rb', threads=threads) as bam:
+        names = list(bam.references)
+        lengths = np.array(bam.lengths, dtype=np.int64)
+        num_contigs = len(names)
+        fragment_counts = np.zeros(num_contigs, dtype=np.int64)
+        read_counts = np.zeros(num_contigs, dtype=np.int64)
+        mapped_fragments = mapped_reads = total_reads = 0
+
+        fragments, mates, tids = [], [], []
+        fragment, name, group_mates = -1, None, set()
+        for read in bam.fetch(until_eof=True):
+            if read.query_name != name:
+                total_reads += len(group_mates)
+                group_mates = set()
+                # Count the finished block at an insert boundary, so no insert is split
+                if len(tids) >= BLOCK_RECORDS:
+                    f, r, mf, mr = count_hits(np.array(fragments), np.array(mates), np.array(tids), num_contigs)
+                    fragment_counts += f
+                    read_counts += r
+                    mapped_fragments += mf
+                    mapped_reads += mr
+                    fragments, mates, tids = [], [], []
+                name = read.query_name
+                fragment += 1
+            group_mates.add(1 if read.is_read1 else 2 if read.is_read2 else 0)
+            if read.is_unmapped:
+                continue
+            fragments.append(fragment)
+            mates.append(int(read.is_read2))
+            tids.append(read.reference_id)
+        if tids:
+            f, r, mf, mr = count_hits(np.array(fragments), np.array(mates), np.array(tids), num_contigs)
+            fragment_counts += f
+            read_counts += r
+            mapped_fragments += mf
+            mapped_reads += mr
+        total_reads += len(group_mates)
+    # Every read name seen is one insert (and each mate one read); those without a mapped record are unmapped
+    unmapped_fragments = (fragment + 1) - mapped_fragments
+    unmapped_reads = total_reads - mapped_reads
+    return (names, lengths, fragment_counts, read_counts, mapped_fragments, mapped_reads,
+            unmapped_fragments, unmapped_reads)
+
+def abundance_units(lengths, fragment_counts, read_counts, mapped_fragments, mapped_reads,
+                    unmapped_fragments=0, unmapped_reads=0):
+    """
+    Derive all units from the counts with vectorised arithmetic, as msamtools profile does.
+
+    The unmapped inserts form the 'Unknown' row; they are given the average
+    length-normalised abundance of the mapped inserts, so that:
+
+        count  inserts; Unknown = unmapped inserts
+        ab     length-normalised abundance, inserts / contig length
+        rel    relative abundance, ab / (sum of ab + Unknown ab); sums to 1 with Unknown
+               = unmapped / all inserts
+        tpm    rel * 1e6
+        fpkm   inserts per kb of contig per million inserts (mapped + unmapped)
+        rpkm   as fpkm, from read counts
+
+    Returns:
+        dict: unit -> (value per contig, Unknown value)
+    """
+    lengths = np.maximum(lengths, 1).astype(np.float64)
+    total_fragments = max(mapped_fragments + unmapped_fragments, 1)
+    total_reads = max(mapped_reads + unmapped_reads, 1)
+
+    ab = fragment_counts / lengths
+    unknown_ab = unmapped_fragments * ab.sum() / mapped_fragments if mapped_fragments else 0.0
+    rel_total = ab.sum() + unknown_ab
+    rel = ab / rel_total if rel_total else ab
+    unknown_rel = unknown_ab / rel_total if rel_total else float(unmapped_fragments > 0)
+
+    read_ab = read_counts / lengths
+    unknown_read_ab = unmapped_reads * read_ab.sum() / mapped_reads if mapped_reads else 0.0
+    return {
+        'count': (fragment_counts, unmapped_fragments),
+        'ab': (ab, unknown_ab),
+        'rel': (rel, unknown_rel),
+        'tpm': (rel * 1e6, unknown_rel * 1e6),
+        'fpkm': (ab * 1e9 / total_fragments, unknown_ab * 1e9 / total_fragments),
+        'rpkm': (read_ab * 1e9 / total_reads, unknown_read_ab * 1e9 / total_reads),
+    }
+
+def write_profile(output_file, label, unit, names, values, unknown, mapped_fragments, mapped_reads, unmapped_fragments, bam_file):
+    # Same layout as msamtools profile: 11 header lines, then an 'Unknown' row and one row per contig
+    header = [
+        '# Profile of contig abundance, msamtools profile layout',
+        f'# Input: {bam_file}',
+        '# Multi-mapper: all',
+        f'# Unit: {unit}',
+        f'# Mapped inserts: {mapped_fragments}',
+        f'# Mapped reads: {mapped_reads}',
+        f'# Unmapped inserts: {unmapped_fragments}',
+        f'# Contigs: {len(names)}',
+        f'# Contigs with inserts: {int(np.count_nonzero(values))}',
+        '# Written by 107_calculate_abundance_units.py',
+        f'ID\t{label}',
+    ]
+    formatted = values.astype(str) if unit == 'count' else np.char.mod('%.6g', values)
+    unknown = str(unknown) if unit == 'count' else f'{unknown:.6g}'
+    rows = np.char.add(np.char.add(np.array(names, dtype=str), '\t'), formatted)
+    with gzip.open(output_file, 'wt', compresslevel=6) as out:
+        # Unknown holds the unmapped inserts in the profile's unit
+        out.write('\n'.join(header) + f'\nUnknown\t{unknown}\n')
+        if len(rows):
+            out.write('\n'.join(rows) + '\n')
+
+def profile_outputs(bam_file, output_dir, units):
+    return [output_dir / f'{bam_file.stem}_profile_{unit}.txt.gz' for unit in units]
+
+def profile_bam_file(bam_file, output_dir, units, threads=2):
+    (names, lengths, fragment_counts, read_counts, mapped_fragments, mapped_reads,
+     unmapped_fragments, unmapped_reads) = count_bam(bam_file, threads)
+    values = abundance_units(lengths, fragment_counts, read_counts, mapped_fragments, mapped_reads,
+                             unmapped_fragments, unmapped_reads)
+    output_files = profile_outputs(bam_file, output_dir, units)
+    with atomic_outputs(*output_files) as temp_files:
+        for unit, temp_file in zip(units, temp_files if len(units) > 1 else [temp_files]):
+            write_profile(temp_file, bam_file.name, unit, names, *values[unit], mapped_fragments, mapped_reads,
+                          unmapped_fragments, bam_file)
+    return bam_file, output_files
+
+def profile_bam_files(input_dir, output_dir, units, jobs=4, threads=2, force=False):
+    input_dir = Path(input_dir)
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    ledger = JobLedger(output_dir, force)
+    params = {'units': units, 'multi': 'all'}
+
+    # Skip BAMs already profiled in the same units from unchanged inputs
+    filter_bam_files = []
+    for bam_file in input_dir.glob('*_sort_filter.bam'):
+        if ledger.is_done(profile_outputs(bam_file, output_dir, units), [bam_file], params):
+            print(f'Skipping {bam_file.name}, output is up to date.')
+        else:
+            filter_bam_files.append(bam_file)
+
+    # One decode per BAM for all units; several samples at once
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(profile_bam_file, bam_file, output_dir, units, threads) for bam_file in filter_bam_files]
+        for future in tqdm(as_completed(futures), total=len(futures), desc='Generating profiles from BAM files'):
+            bam_file, output_files = future.result()
+            ledger.record(output_files, [bam_file], params)
+            print(f'Generated {", ".join(f.name for f in output_files)} for {bam_file}')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate count, ab, rel, FPKM, TPM and RPKM profiles (msamtools units) from filtered BAM files '
+                                                 'in a single pass per BAM (pysam).',
+                                     epilog='Example: python script.py -i /path/to/filtered_bam_files -o /path/to/profile_output -u fpkm,tpm -j 8')
+    parser.add_argument('-i', '--input', required=True, help='Input directory containing filtered BAM files (sorted by read name)')
+    parser.add_argument('-o', '--output', required=True, help='Output directory for profile text files')
+    parser.add_argument('-u', '--units', default=','.join(UNITS),
+                        help=f'Comma-separated units to write, from {",".join(UNITS)} (default: all)')
+    parser.add_argument('-j', '--jobs', type=int, default=4, help='Number of BAM files processed at once (default: 4)')
+    parser.add_argument('-t', '--threads', type=int, default=2, help='BGZF decompression threads per BAM (default: 2)')
+    parser.add_argument('--force', action='store_true', help='Redo files even if their outputs are up to date')
+    args = parser.parse_args()
+
+    units = [unit.strip() for unit in args.units.split(',') if unit.strip()]
+    unknown = [unit for unit in units if unit not in UNITS]
+    if unknown:
+        parser.error(f'unknown unit(s): {", ".join(unknown)}')
+
+    try:
+        profile_bam_files(args.input, args.output, units, args.jobs, args.threads, args.force)
+        print("Profile generation completed successfully.")
+    except Exception as e:
+        print(f"Error during profile generation: {e}")
@@ -2,17 +2,26 @@ import argparse
 import subprocess
 from pathlib import Path
 from tqdm import tqdm
+from job_ledger import JobLedger, atomic_outputs
 
-def coverage_analysis(input_dir, output_dir):
+def coverage_analysis(input_dir, output_dir, force=False):
     input_dir = Path(input_dir)
     output_dir = Path(output_dir)
     output_dir.mkdir(parents=True, exist_ok=True)
+    ledger = JobLedger(output_dir, force)
+    params = {'options': ['-z', '--summary']}
 
     bam_files = list(input_dir.glob('*_sort_filter.bam'))
     for bam_file in tqdm(bam_files, desc='Calculating coverage information'):
         output_file = output_dir / (bam_file.stem + '_coverage_info.txt.gz')
-        cmd = ['msamtools', 'coverage', '-z', '--summary', '-o', str(output_file), str(bam_file)]
-        subprocess.run(cmd, check=True)
+        # Skip only samples finished from unchanged inputs; half-written outputs never count
+        if ledger.is_done([output_file], [bam_file], params):
+            print(f'Skipping {bam_file.name}, output is up to date.')
+            continue
+        with atomic_outputs(output_file) as temp_file:
+            cmd = ['msamtools', 'coverage', '-z', '--summary', '-o', str(temp_file), str(bam_file)]
+            subprocess.run(cmd, check=True)
+        ledger.record([output_file], [bam_file], params)
         print(f'Generated coverage information for {bam_file} into {output_file}')
 
 if __name__ == '__main__':
@@ -20,10 +29,11 @@ if __name__ == '__main__':
                                      epilog='Example: python script.py -i /path/to/filtered_bam_files -o /path/to/coverage_info')
     parser.add_argument('-i', '--input', required=True, help='Input directory containing filtered BAM files')
     parser.add_argument('-o', '--output', required=True, help='Output directory for coverage information files')
+    parser.add_argument('--force', action='store_true', help='Redo files even if their outputs are up to date')
     args = parser.parse_args()
 
     try:
-        coverage_analysis(args.input, args.output)
+        coverage_analysis(args.input, args.output, args.force)
         print("Coverage analysis completed successfully.")
     except Exception as e:
         print(f"Error during coverage analysis: {e}")
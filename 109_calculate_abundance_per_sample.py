@@ -1,77 +1,240 @@
 import os
 import gzip
 import argparse
+import importlib.util
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-def process_files(input_folder, output_folder, threshold):
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+from job_ledger import JobLedger, atomic_outputs
+
+COVERAGE_SUFFIX = "_coverage.txt.gz"
+PROFILE_SUFFIX = "_profile.txt.gz"
+# Matrix formats and their file extensions
+MATRIX_FORMATS = {'text': '.txt', 'parquet': '.parquet'}
+# Engines pandas can write Parquet with
+PARQUET_ENGINES = ('pyarrow', 'fastparquet')
+
+def count_header_lines(file_path, max_lines=1000):
+    """
+    Count the header lines at the top of a two-column text file.
+
+    Header lines start with '#' or have no number in their second field
+    (e.g. 'ID<TAB>sample.bam'), so both msamtools layouts (9 or 11 lines) are detected.
+    """
+    count = 0
+    with gzip.open(file_path, 'rt') as infile:
+        for line in infile:
+            fields = line.split()
+            if count >= max_lines or (not line.startswith('#') and len(fields) >= 2 and _is_number(fields[1])):
+                break
+            count += 1
+    return count
+
+def _is_number(text):
+    try:
+        float(text)
+        return True
+    except ValueError:
+        return False
+
+def read_two_columns(file_path, value_dtype=str):
+    """Read the contig ID and value columns of a whitespace-separated file, skipping its header block."""
+    return pd.read_csv(file_path, sep=r'\s+', header=None, names=['contig', 'value'], usecols=[0, 1],
+                       skiprows=count_header_lines(file_path), dtype={'contig': str, 'value': value_dtype},
+                       keep_default_na=False, float_precision='round_trip')
+
+def sample_abundance(coverage_file, profile_file, threshold):
+    """
+    Abundance of each profile contig, with contigs at or below the coverage threshold masked out.
+
+    Returns:
+        DataFrame: 'contig', 'value' (profile text) and 'passed' (coverage > threshold) columns
+    """
+    # Contigs passing the coverage threshold
+    coverage = read_two_columns(coverage_file, float)
+    passed = coverage.loc[coverage['value'] > float(threshold), 'contig']
+
+    # Keep the abundance of passing contigs as written in the profile, zero for the rest
+    profile = read_two_columns(profile_file)
+    profile['passed'] = profile['contig'].isin(passed).to_numpy()
+    return profile
+
+def process_sample(coverage_file, profile_file, output_file, threshold):
+    profile = sample_abundance(coverage_file, profile_file, threshold)
+    profile['value'] = profile['value'].where(profile['passed'], '0')
+    profile[['contig', 'value']].to_csv(output_file, sep='\t', header=False, index=False)
+    return output_file, int(profile['passed'].sum()), len(profile)
+
+def sample_values(coverage_file, profile_file, threshold):
+    """Contig IDs and float64 abundances of one sample, zero below the coverage threshold."""
+    profile = sample_abundance(coverage_file, profile_file, threshold)
+    values = pd.to_numeric(profile['value'], errors='coerce').fillna(0).to_numpy(np.float64)
+    values = np.where(profile['passed'].to_numpy(), values, 0.0)
+    return profile['contig'].to_numpy(dtype=object), values
+
+def build_matrix(samples, threshold, jobs=1):
+    """
+    Fill a contig x sample matrix straight from the per-sample results, without text intermediates.
+
+    Rows follow the contig order of the first sample; contigs missing from a sample stay 0.
+
+    Returns:
+        Index: Contig IDs (rows)
+        ndarray: float64 matrix, one column per sample in the given order
+    """
+    index, matrix = None, None
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(sample_values, coverage_file, profile_file, threshold)
+                   for _, coverage_file, profile_file in samples]
+        # Results are consumed in sample order, so the row order does not depend on timing
+        for column, future in enumerate(tqdm(futures, desc="Processing samples")):
+            contigs, values = future.result()
+            if matrix is None:
+                # Preallocate from the first sample; all profiles normally share one contig list
+                index = pd.Index(pd.unique(contigs))
+                matrix = np.zeros((len(index), len(samples)), dtype=np.float64)
+            rows = index.get_indexer(contigs)
+            if (rows == -1).any():
+                new_contigs = pd.Index(pd.unique(contigs[rows == -1]))
+                index = index.append(new_contigs)
+                matrix = np.vstack([matrix, np.zeros((len(new_contigs), len(samples)), dtype=np.float64)])
+                rows = index.get_indexer(contigs)
+            matrix[rows, column] = values
+    return index, matrix
+
+def writable_formats(formats):
+    """Drop 'parquet' from the requested matrix formats if no Parquet engine is installed."""
+    if 'parquet' in formats and not any(importlib.util.find_spec(engine) for engine in PARQUET_ENGINES):
+        print("Parquet output needs pyarrow; skipping the binary matrix")
+        return tuple(fmt for fmt in formats if fmt != 'parquet')
+    return tuple(formats)
+
+def write_matrix(index, matrix, sample_names, output_prefix, formats=('text', 'parquet')):
+    """
+    Write the matrix as tab-separated text (110 layout) and/or Parquet, once each.
+
+    Each file is written under a temporary name and renamed into place when complete.
+    """
+    df = pd.DataFrame(matrix, index=index, columns=sample_names)
+    df.index.name = 'contig_ID'
+    output_files = []
+    if 'text' in formats:
+        with atomic_outputs(output_prefix + MATRIX_FORMATS['text']) as temp_file:
+            # Same float32 values and number formatting as 110, so the two matrices diff cleanly
+            df.astype(np.float32).to_csv(temp_file, sep='\t', float_format='%.7g')
+        output_files.append(output_prefix + MATRIX_FORMATS['text'])
+    if 'parquet' in formats:
+        with atomic_outputs(output_prefix + MATRIX_FORMATS['parquet']) as temp_file:
+            df.reset_index().to_parquet(temp_file, index=False)
+        output_files.append(output_prefix + MATRIX_FORMATS['parquet'])
+    return output_files
+
+def find_samples(input_folder, coverage_suffix=COVERAGE_SUFFIX, profile_suffix=PROFILE_SUFFIX):
+    """Return (sample name, coverage file, profile file) for each coverage file in the folder."""
+    samples = []
+    for file_name in sorted(os.listdir(input_folder)):
+        if file_name.endswith(coverage_suffix):
+            sample_name = file_name[:-len(coverage_suffix)]
+            samples.append((sample_name, os.path.join(input_folder, file_name),
+                            os.path.join(input_folder, sample_name + profile_suffix)))
+    return samples
+
+def process_files(input_folder, output_folder, threshold, jobs=1, coverage_suffix=COVERAGE_SUFFIX, profile_suffix=PROFILE_SUFFIX,
+                  matrix_prefix=None, matrix_formats=('text', 'parquet'), force=False):
     """
     Process coverage and profile files to generate abundance statistics for contigs.
-    
+
     Args:
         input_folder (str): Path to the folder containing coverage and profile files
         output_folder (str): Path to the folder where output files will be saved
         threshold (float): Coverage threshold for filtering contigs
-        
+        jobs (int): Number of samples processed at once
+        coverage_suffix (str): Suffix of the coverage files
+        profile_suffix (str): Suffix of the matching profile files
+        matrix_prefix (str): Write one contig x sample matrix '<prefix>.txt' / '<prefix>.parquet'
+            in output_folder instead of per-sample files
+        matrix_formats (tuple): Matrix formats to write, 'text' and/or 'parquet'
+        force (bool): Rebuild the matrix even if it is up to date
+
     The function processes pairs of files:
     - *_coverage.txt.gz: Contains coverage information for contigs
     - *_profile.txt.gz: Contains abundance profiles
     """
-    for file_name in os.listdir(input_folder):
-        # Process files ending with _coverage.txt.gz
-        if file_name.endswith("_coverage.txt.gz"):
-            # Extract sample name by removing the suffix (14 characters)
-            sample_name = file_name[:-16]
-            
-            # Construct file paths
-            coverage_file = os.path.join(input_folder, file_name)
-            profile_file = os.path.join(input_folder, sample_name + "_profile.txt.gz")
-            output_file = os.path.join(output_folder, sample_name + "_existing_contigs_ab_per_sample.txt")
-            
-            # Dictionary to store contigs passing coverage threshold
-            dictlt = {}
-            
-            # Process coverage file
-            with gzip.open(coverage_file, 'rt') as infile:
-                for line in infile:
-                    lst = line.strip().split()
-                    # Filter contigs based on coverage threshold
-                    if float(lst[1]) > float(threshold):
-                        dictlt[lst[0]] = lst[0]
-            
-            # Process profile file and write results
-            with gzip.open(profile_file, 'rt') as infile:
-                with open(output_file, 'w') as outfile:
-                    # Skip header lines (first 11 lines)
-                    for i in range(11):
-                        infile.readline()
-                    
-                    # Process each contig
-                    for line in infile:
-                        lst = line.strip().split()
-                        try:
-                            # If contig passed coverage threshold, write its abundance
-                            st = "{}\t{}\n".format(dictlt[lst[0]], lst[1])
-                            outfile.write(st)
-                        except:
-                            # If contig didn't pass threshold, write zero abundance
-                            st = "{}\t{}\n".format(lst[0], 0)
-                            outfile.write(st)
+    os.makedirs(output_folder, exist_ok=True)
+    samples = find_samples(input_folder, coverage_suffix, profile_suffix)
+
+    if matrix_prefix:
+        # Combined mode: one contig x sample matrix instead of per-sample files
+        output_prefix = os.path.join(output_folder, matrix_prefix)
+        # The ledger checks and records only the formats that can actually be written
+        matrix_formats = writable_formats(matrix_formats)
+        outputs = [output_prefix + MATRIX_FORMATS[fmt] for fmt in matrix_formats]
+        inputs = [file for _, coverage_file, profile_file in samples for file in (coverage_file, profile_file)]
+        params = {'threshold': threshold, 'samples': [sample_name for sample_name, _, _ in samples]}
+        # Skip only if the matrix was built from these exact inputs and threshold
+        ledger = JobLedger(output_folder, force)
+        if ledger.is_done(outputs, inputs, params):
+            print(f"{', '.join(outputs)} up to date, skipping")
+            return
+        index, matrix = build_matrix(samples, threshold, jobs)
+        output_files = write_matrix(index, matrix, params['samples'], output_prefix, matrix_formats)
+        ledger.record(output_files, inputs, params)
+        print(f"Wrote {len(index)} contigs x {len(samples)} samples to {', '.join(output_files)}")
+        return
+
+    # Process samples in parallel, one process per sample
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(process_sample, coverage_file, profile_file,
+                                   os.path.join(output_folder, sample_name + "_existing_contigs_ab_per_sample.txt"), threshold)
+                   for sample_name, coverage_file, profile_file in samples]
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Processing samples"):
+            output_file, kept, total = future.result()
+            print(f"{output_file}: {kept} of {total} contigs above the coverage threshold")
 
 if __name__ == "__main__":
     # Set up command line argument parser
-    parser = argparse.ArgumentParser(description="Process coverage and profile files for contig abundance analysis.")
-    parser.add_argument("-i", "--input", 
-                       required=True, 
+    parser = argparse.ArgumentParser(description="Process coverage and profile files for contig abundance analysis.",
+                                     epilog="Example: python script.py -i profiles -o abundance -t 0.55 -j 8 [-m contig_abundance]")
+    parser.add_argument("-i", "--input",
+                       required=True,
                        help="Input folder containing coverage and profile files.")
-    parser.add_argument("-o", "--output", 
-                       required=True, 
+    parser.add_argument("-o", "--output",
+                       required=True,
                        help="Output folder for processed abundance files.")
-    parser.add_argument("-t", "--threshold", 
-                       type=float, 
-                       default=0.55, 
+    parser.add_argument("-t", "--threshold",
+                       type=float,
+                       default=0.55,
                        help="Coverage threshold for filtering contigs (default: 0.55).")
-    
+    parser.add_argument("-j", "--jobs",
+                       type=int,
+                       default=4,
+                       help="Number of samples processed in parallel (default: 4).")
+    parser.add_argument("--coverage_suffix",
+                       default=COVERAGE_SUFFIX,
+                       help=f"Suffix of coverage files (default: {COVERAGE_SUFFIX}; use _coverage_info.txt.gz for 108 output).")
+    parser.add_argument("--profile_suffix",
+                       default=PROFILE_SUFFIX,
+                       help=f"Suffix of profile files (default: {PROFILE_SUFFIX}; use _profile_rb.txt.gz for 107 output).")
+
+    parser.add_argument("-m", "--matrix",
+                       default=None,
+                       help="Combined mode: write one contig x sample matrix with this name prefix in the output folder.")
+    parser.add_argument("--matrix_formats",
+                       default="text,parquet",
+                       help="Comma-separated matrix formats, text and/or parquet (default: text,parquet).")
+    parser.add_argument("--force",
+                       action="store_true",
+                       help="Rebuild the matrix even if it is up to date.")
+
     # Parse command line arguments
     args = parser.parse_args()
-    
+    matrix_formats = tuple(fmt.strip() for fmt in args.matrix_formats.split(',') if fmt.strip())
+    unknown = [fmt for fmt in matrix_formats if fmt not in MATRIX_FORMATS]
+    if unknown or not matrix_formats:
+        parser.error(f"--matrix_formats must list text and/or parquet, got: {args.matrix_formats}")
+
     # Run the processing function
-    process_files(args.input, args.output, args.threshold)
+    process_files(args.input, args.output, args.threshold, args.jobs, args.coverage_suffix, args.profile_suffix,
+                  args.matrix, matrix_formats, args.force)
@@ -1,37 +1,128 @@
 import os
 import argparse
-from collections import defaultdict
-
-def linear_paste_relative_contig_abundance(input_files, output_file):
-    if os.path.exists(output_file):
-        pass
-    else:
-        dict_ab = defaultdict(str)
-        header = "contig_ID"
-
-        for file in input_files:
-            sample_ID = os.path.basename(file)[:-len("_existing_contigs_ab_per_sample.txt")]
-            header += "\t" + sample_ID
-            with open(file, "r") as infile:
-                for line in infile:
-                    lst = line.strip().split()
-                    dict_ab[lst[0]] += "\t" + lst[1]
-
-        with open(output_file, "w") as outfile:
-            header += "\n"
-            outfile.write(header)
-            for k, v in dict_ab.items():
-                st = "{}{}\n".format(k, v)
-                outfile.write(st)
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+from job_ledger import JobLedger, atomic_outputs
+from abundance_matrix import csr_from_coo, write_sparse
+
+SAMPLE_SUFFIX = "_existing_contigs_ab_per_sample.txt"
+
+def sample_id(file):
+    name = os.path.basename(file)
+    return name[:-len(SAMPLE_SUFFIX)] if name.endswith(SAMPLE_SUFFIX) else os.path.splitext(name)[0]
+
+def read_sample(file):
+    """Contig IDs and float32 abundances of one per-sample file (two whitespace-separated columns)."""
+    df = pd.read_csv(file, sep=r'\s+', header=None, names=['contig', 'value'], usecols=[0, 1],
+                     dtype={'contig': str, 'value': np.float32}, keep_default_na=False)
+    return df['contig'].to_numpy(dtype=object), df['value'].to_numpy()
+
+def intern_samples(input_files):
+    """
+    Intern contig IDs to integer rows, in first-seen order over the input files.
+
+    Returns:
+        Index: Contig IDs (rows)
+        list: (rows, float32 values) of each input file
+    """
+    index = pd.Index([], dtype=object)
+    columns = []
+    for file in tqdm(input_files, desc="Reading samples"):
+        contigs, values = read_sample(file)
+        rows = index.get_indexer(contigs)
+        new = rows == -1
+        if new.any():
+            index = index.append(pd.Index(pd.unique(contigs[new])))
+            rows = index.get_indexer(contigs)
+        columns.append((rows, values))
+    return index, columns
+
+def build_abundance_matrix(input_files):
+    """
+    Fill a float32 contig x sample matrix; a contig missing from a sample gets an explicit 0.
+
+    Returns:
+        Index: Contig IDs (rows)
+        ndarray: float32 matrix, one column per input file
+    """
+    index, columns = intern_samples(input_files)
+
+    # Allocate once the number of contigs is known, then scatter each sample into its column
+    matrix = np.zeros((len(index), len(input_files)), dtype=np.float32)
+    for column, (rows, values) in enumerate(columns):
+        matrix[rows, column] = values
+    return index, matrix
+
+def build_sparse_matrix(input_files):
+    """
+    CSR arrays of the contig x sample matrix, built from the per-sample columns without a dense copy.
+
+    Returns:
+        Index: Contig IDs (rows)
+        tuple: (indptr, indices, data) CSR arrays
+    """
+    index, columns = intern_samples(input_files)
+    rows = np.concatenate([rows for rows, _ in columns]) if columns else np.array([], dtype=np.int64)
+    cols = np.concatenate([np.full(len(r), column) for column, (r, _) in enumerate(columns)]) if columns else rows
+    values = np.concatenate([values for _, values in columns]) if columns else np.array([], dtype=np.float32)
+    return index, csr_from_coo(rows, cols, values, (len(index), len(input_files)))
+
+def write_ledgered(output_file, input_files, params, ledger, write):
+    # Skip only if the output was built from these exact inputs (size and mtime) in this order
+    if ledger.is_done([output_file], input_files, params):
+        print(f"{output_file} is up to date, skipping")
+        return
+    with atomic_outputs(output_file) as temp_file:
+        write(temp_file)
+    ledger.record([output_file], input_files, params)
+
+def linear_paste_relative_contig_abundance(input_files, output_file, force=False, sparse_file=None):
+    """
+    Paste per-sample abundances into one contig x sample matrix.
+
+    Args:
+        input_files (list): Per-sample two-column abundance files, one column each in this order
+        output_file (str): Tab-separated text matrix (skipped if None)
+        force (bool): Rebuild outputs even if they are up to date
+        sparse_file (str): Also write the matrix in the sparse .npz format (abundance_matrix.py)
+    """
+    params = {'samples': [sample_id(file) for file in input_files]}
+
+    if output_file:
+        def write_text(temp_file):
+            index, matrix = build_abundance_matrix(input_files)
+            # Vectorised formatting; '%.7g' keeps float32 precision and writes missing cells as 0
+            df = pd.DataFrame(matrix, index=index, columns=params['samples'])
+            df.index.name = "contig_ID"
+            df.to_csv(temp_file, sep="\t", float_format="%.7g")
+            print(f"Wrote {len(index)} contigs x {len(input_files)} samples to {output_file}")
+        ledger = JobLedger(os.path.dirname(os.path.abspath(output_file)), force)
+        write_ledgered(output_file, input_files, params, ledger, write_text)
+
+    if sparse_file:
+        def write_npz(temp_file):
+            index, (indptr, indices, data) = build_sparse_matrix(input_files)
+            write_sparse(temp_file, index, params['samples'], indptr, indices, data)
+            print(f"Wrote {len(index)} contigs x {len(input_files)} samples ({len(data)} non-zero) to {sparse_file}")
+        ledger = JobLedger(os.path.dirname(os.path.abspath(sparse_file)), force)
+        write_ledgered(sparse_file, input_files, params, ledger, write_npz)
 
 def main():
-    parser = argparse.ArgumentParser(description="Combine contig abundance data from multiple samples.")
+    parser = argparse.ArgumentParser(description="Combine contig abundance data from multiple samples.",
+                                     epilog="Example: python script.py -i abundance/*_existing_contigs_ab_per_sample.txt -o contig_abundance.txt [-s contig_abundance.npz]")
     parser.add_argument("-i", "--inputs", nargs='+', required=True, help="Input files (multiple, space separated).")
-    parser.add_argument("-o", "--output", required=True, help="Output file path.")
+    parser.add_argument("-o", "--output", help="Output file path (tab-separated text).")
+    parser.add_argument("-s", "--sparse", help="Also (or only) write the matrix in the sparse, memory-mappable .npz format.")
+    parser.add_argument("--force", action="store_true", help="Rebuild the output even if it is up to date.")
     args = parser.parse_args()
+    if not args.output and not args.sparse:
+        parser.error("give -o/--output and/or -s/--sparse")
+    if args.sparse and not args.sparse.endswith('.npz'):
+        parser.error("the sparse output file must end in .npz")
 
-    linear_paste_relative_contig_abundance(args.inputs, args.output)
+    linear_paste_relative_contig_abundance(args.inputs, args.output, args.force, args.sparse)
 
 if __name__ == "__main__":
     main()
-
@@ -42,6 +42,17 @@ doit() {
 
 export -f doit
 
+# Re-run PADLOC on selected contigs only (e.g. defense-positive ones), fetched from the
+# full FASTA through its cached index instead of grepping it:
+# CONTIG_IDS=ids.txt FASTA=Source/02_contigs/03_chromosome/metagenome_chromosome.fasta TYPE=chromosome bash 203_annotate_padloc_version2.sh
+if [ -n "${CONTIG_IDS:-}" ]; then
+    SUBSET=Process/03.Defense/01.PADLOC/${TYPE}/subsets/$(basename "$CONTIG_IDS" .txt).fasta
+    mkdir -p "$(dirname "$SUBSET")"
+    python "$(dirname "$0")/fasta_index.py" -i "$FASTA" -n "$CONTIG_IDS" -o "$SUBSET" || exit 1
+    doit "$SUBSET" "$TYPE"
+    exit $?
+fi
+
 echo "[$(date)] Starting PADLOC batch annotation..."
 
 # chromosome
@@ -1,5 +1,10 @@
 import pandas as pd
+import numpy as np
 import argparse
+from tqdm import tqdm
+
+# PADLOC numbers each system found on a contig; its genes share the number
+SYSTEM_NUMBER = 'system.number'
 
 def merge_files(expanded_file, padloc_file, output_file):
     # Read files
@@ -20,14 +25,137 @@ def merge_files(expanded_file, padloc_file, output_file):
     # Save to new file
     merged_df.to_csv(output_file, sep='\t', index=False)
 
+def read_loci(padloc_file):
+    """
+    One locus per PADLOC system instance, spanning its genes (or one per row without 'system.number').
+
+    Returns:
+        DataFrame: 'seqid', 'system', 'start', 'end'
+    """
+    header = pd.read_csv(padloc_file, sep='\t', nrows=0).columns
+    columns = ['seqid', 'system', 'start', 'end'] + ([SYSTEM_NUMBER] if SYSTEM_NUMBER in header else [])
+    padloc_df = pd.read_csv(padloc_file, sep='\t', usecols=columns)
+    if SYSTEM_NUMBER not in columns:
+        return padloc_df
+    return padloc_df.groupby(['seqid', 'system', SYSTEM_NUMBER], sort=False).agg(start=('start', 'min'), end=('end', 'max')).reset_index()
+
+def locus_index(loci):
+    """
+    Per (contig, system) interval index, sorted by start.
+
+    Returns:
+        dict: (seqid, system) -> (starts, ends, running maximum of ends)
+    """
+    loci = loci.sort_values(['seqid', 'system', 'start', 'end'], kind='stable')
+    index = {}
+    for key, group in loci.groupby(['seqid', 'system'], sort=False):
+        ends = group['end'].to_numpy()
+        index[key] = (group['start'].to_numpy(), ends, np.maximum.accumulate(ends))
+    return index
+
+def find_locus(starts, ends, max_ends, position):
+    """Locus containing position (the one starting closest before it), or -1; binary search on starts."""
+    i = np.searchsorted(starts, position, side='right') - 1
+    # Step back only while an earlier locus can still reach the position
+    while i >= 0 and max_ends[i] >= position:
+        if ends[i] >= position:
+            return i
+        i -= 1
+    return -1
+
+def match_loci(expanded_file, padloc_file, output_file, hit_start=None, hit_end=None, chunksize=100000):
+    """
+    Give each expanded defense hit a single PADLOC locus instead of every locus of its subtype.
+
+    With hit_start (and optionally hit_end), a hit gets the locus containing its start
+    (or midpoint); each hit costs one binary search in its contig's interval index.
+    Without hit coordinates, the k-th hit of a (Contig_ID, Defense_Subtype) in file order
+    gets the k-th locus of that system on the contig in start order, which is only a
+    guess when a contig carries the system more than once. The added Locus_Match
+    column says which rule gave each row its coordinates ('coordinates' or 'order');
+    hits without a locus get '.' throughout. The expanded file is streamed in chunks.
+
+    Args:
+        expanded_file (str): Expanded defense info, tab-separated with Contig_ID and Defense_Subtype
+        padloc_file (str): PADLOC output (seqid, system, start, end[, system.number])
+        output_file (str): Output file with Start, End and Locus_Match columns added
+        hit_start (str): Column of the expanded file with the hit start coordinate
+        hit_end (str): Column of the expanded file with the hit end coordinate
+        chunksize (int): Rows of the expanded file processed at once
+    """
+    # 1. Build the per-contig interval index of PADLOC loci
+    index = locus_index(read_loci(padloc_file))
+    print(f"Indexed {sum(len(starts) for starts, _, _ in index.values())} loci on {len(index)} contig/system pairs")
+
+    if hit_start is None:
+        print("Warning: no --hit_start column given; loci are assigned by order of appearance, not by coordinates "
+              "(rows marked 'order' in Locus_Match)")
+
+    # 2. Stream the expanded hits and assign each its own locus
+    used = {}
+    rule = 'order' if hit_start is None else 'coordinates'
+    guessed = 0
+    with open(output_file, 'w', newline='') as out:
+        reader = pd.read_csv(expanded_file, sep='\t', chunksize=chunksize)
+        for i, chunk in enumerate(tqdm(reader, desc="Matching loci", unit='chunk')):
+            start = np.full(len(chunk), '.', dtype=object)
+            end = np.full(len(chunk), '.', dtype=object)
+            match = np.full(len(chunk), '.', dtype=object)
+            for key, rows in chunk.groupby(['Contig_ID', 'Defense_Subtype'], sort=False).indices.items():
+                if key not in index:
+                    continue
+                starts, ends, max_ends = index[key]
+                if hit_start is None:
+                    # k-th hit <-> k-th locus, counting on across chunks
+                    first = used.get(key, 0)
+                    used[key] = first + len(rows)
+                    loci = np.arange(first, first + len(rows))
+                    loci[loci >= len(starts)] = -1
+                    if len(starts) > 1:
+                        guessed += int((loci >= 0).sum())
+                else:
+                    positions = chunk[hit_start].to_numpy()[rows]
+                    if hit_end is not None:
+                        positions = (positions + chunk[hit_end].to_numpy()[rows]) / 2
+                    loci = np.array([find_locus(starts, ends, max_ends, position) for position in positions])
+                found = loci >= 0
+                start[rows[found]] = starts[loci[found]]
+                end[rows[found]] = ends[loci[found]]
+                match[rows[found]] = rule
+
+            # 3. Append the chunk with its Start, End and Locus_Match columns
+            chunk['Start'] = start
+            chunk['End'] = end
+            chunk['Locus_Match'] = match
+            chunk.to_csv(out, sep='\t', index=False, header=(i == 0))
+    if guessed:
+        print(f"Warning: {guessed} hits on contigs with several loci of their system were matched by order; "
+              "pass --hit_start/--hit_end to match them by coordinates")
+
 def main():
-    parser = argparse.ArgumentParser(description="Merge defense info with PADLOC data")
+    parser = argparse.ArgumentParser(description="Merge defense info with PADLOC data",
+                                     epilog="Example: python script.py -e Expanded_defense_info.txt -p PADLOC.txt -o output.txt [-m locus [--hit_start Gene_Start --hit_end Gene_End]]")
     parser.add_argument('-e', '--expanded', help="Expanded_defense_info.txt file")
     parser.add_argument('-p', '--padloc', help="PADLOC.txt file")
     parser.add_argument('-o', '--output', help="Output file")
+    parser.add_argument('-m', '--match', choices=['subtype', 'locus'], default='subtype',
+                        help="subtype: every PADLOC row of the contig and subtype (default); "
+                             "locus: one PADLOC system instance per expanded hit, by coordinates with --hit_start, "
+                             "otherwise by order of appearance (marked in the Locus_Match column)")
+    parser.add_argument('--hit_start', default=None,
+                        help="Locus mode: column of the expanded file with the hit start; the hit gets the locus containing it")
+    parser.add_argument('--hit_end', default=None,
+                        help="Locus mode: column of the expanded file with the hit end; the hit midpoint is used")
+    parser.add_argument('-c', '--chunksize', type=int, default=100000,
+                        help="Locus mode: rows of the expanded file processed at once (default: 100000)")
     args = parser.parse_args()
+    if args.hit_end and not args.hit_start:
+        parser.error("--hit_end needs --hit_start")
 
-    merge_files(args.expanded, args.padloc, args.output)
+    if args.match == 'locus':
+        match_loci(args.expanded, args.padloc, args.output, args.hit_start, args.hit_end, args.chunksize)
+    else:
+        merge_files(args.expanded, args.padloc, args.output)
 
 if __name__ == "__main__":
     main()
@@ -1,39 +1,209 @@
 import argparse
+import warnings
 import pandas as pd
 import numpy as np
 from tqdm import tqdm
+from abundance_matrix import read_sparse, is_sparse_file, csr_from_dense, write_sparse
+
+STATS = ['mean', 'sum', 'median', 'sd', 'prevalence']
+# Stored values of a sparse input handled per bincount, bounding the temporary arrays
+BLOCK_VALUES = 50_000_000
+
+def group_columns(samples, grouping, ordered_groups):
+    """
+    Group number of each matrix column (-1 for columns outside the grouping file).
+
+    Raises KeyError if a sample of the grouping file is not in the matrix, as the
+    per-group column selection used to.
+    """
+    samples = pd.Index(samples)
+    missing = [sample for sample in grouping.index if sample not in samples]
+    if missing:
+        raise KeyError(f"Samples not in the input matrix: {', '.join(map(str, missing))}")
+    return pd.Index(ordered_groups).get_indexer(grouping.reindex(samples))
+
+def result_columns(ordered_groups, stats):
+    """Output column names: the group names for a single statistic, '<group>_<stat>' otherwise."""
+    if len(stats) == 1:
+        return list(ordered_groups)
+    return [f'{group}_{stat}' for group in ordered_groups for stat in stats]
+
+def stack_stats(results, stats, num_groups):
+    """Interleave per-statistic (rows x groups) arrays into one (rows x groups*stats) array."""
+    return np.stack([results[stat] for stat in stats], axis=2).reshape(-1, num_groups * len(stats))
+
+def group_stats(values, column_groups, num_groups, stats):
+    """
+    Statistics of every group for a dense block of rows, in one pass over the block.
+
+    Sums, counts and prevalence come from a product with a samples x groups indicator
+    matrix, SD from a second product of the squared deviations; only the median needs
+    one sort per group. Missing values (NaN) are skipped, as in pandas.
+
+    Args:
+        values (ndarray): rows x samples block
+        column_groups (ndarray): Group number of each column, -1 to ignore the column
+        num_groups (int): Number of groups
+        stats (list): Statistics to compute, from STATS
+
+    Returns:
+        dict: statistic -> rows x groups float64 array
+    """
+    used = column_groups >= 0
+    values = np.asarray(values, dtype=np.float64)[:, used]
+    groups = column_groups[used]
+    indicator = np.zeros((len(groups), num_groups))
+    indicator[np.arange(len(groups)), groups] = 1
+
+    present = ~np.isnan(values)
+    filled = np.where(present, values, 0.0)
+    counts = present @ indicator
+    sums = filled @ indicator
+    results = {}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+        if 'mean' in stats:
+            results['mean'] = means
+        if 'sum' in stats:
+            results['sum'] = sums
+        if 'sd' in stats:
+            deviations = np.where(present, filled - means[:, groups], 0.0)
+            results['sd'] = np.sqrt((deviations ** 2 @ indicator) / (counts - 1))
+        if 'prevalence' in stats:
+            results['prevalence'] = (filled > 0) @ indicator / counts
+    if 'median' in stats:
+        medians = np.full((len(values), num_groups), np.nan)
+        with warnings.catch_warnings():
+            # All-missing rows give NaN, like pandas
+            warnings.simplefilter('ignore', RuntimeWarning)
+            for group in range(num_groups):
+                if (groups == group).any():
+                    medians[:, group] = np.nanmedian(values[:, groups == group], axis=1)
+        results['median'] = medians
+    return results
+
+def sparse_group_stats(matrix, column_groups, num_groups, stats, chunksize=None):
+    """
+    Group statistics of a sparse matrix from its stored values.
+
+    Sums, sums of squares and non-zero counts of each (contig, group) cell are
+    accumulated with bincount; absent cells are zeros and are never materialised.
+    Only the median densifies, one block of rows at a time.
+    """
+    group_sizes = np.bincount(column_groups[column_groups >= 0], minlength=num_groups).astype(np.float64)
+    size = matrix.shape[0] * num_groups
+    sums, squares, nonzero = np.zeros(size), np.zeros(size), np.zeros(size)
+    for start in tqdm(range(0, matrix.nnz, BLOCK_VALUES), desc="Processing values"):
+        stop = min(start + BLOCK_VALUES, matrix.nnz)
+        groups = column_groups[matrix.indices[start:stop]]
+        keep = groups >= 0
+        rows = np.searchsorted(matrix.indptr, np.arange(start, stop), side='right') - 1
+        cells = rows[keep] * num_groups + groups[keep]
+        data = np.asarray(matrix.data[start:stop], dtype=np.float64)[keep]
+        sums += np.bincount(cells, weights=data, minlength=size)
+        squares += np.bincount(cells, weights=data ** 2, minlength=size)
+        nonzero += np.bincount(cells, weights=(data > 0).astype(np.float64), minlength=size)
+    sums, squares, nonzero = (array.reshape(matrix.shape[0], num_groups) for array in (sums, squares, nonzero))
+
+    results = {}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if 'mean' in stats:
+            results['mean'] = sums / group_sizes
+        if 'sum' in stats:
+            results['sum'] = sums
+        if 'sd' in stats:
+            variance = (squares - sums ** 2 / group_sizes) / (group_sizes - 1)
+            results['sd'] = np.sqrt(np.maximum(variance, 0))
+        if 'prevalence' in stats:
+            results['prevalence'] = nonzero / group_sizes
+    if 'median' in stats:
+        block = chunksize or 100000
+        results['median'] = np.vstack([
+            group_stats(matrix.to_dense(start, start + block), column_groups, num_groups, ['median'])['median']
+            for start in tqdm(range(0, matrix.shape[0], block), desc="Medians", unit='block')
+        ]) if matrix.shape[0] else np.zeros((0, num_groups))
+    return results
 
 def main():
     # 1. Parse command line arguments
-    parser = argparse.ArgumentParser(description="Merge and average samples in a CSV file based on grouping information.")
-    parser.add_argument('-i', '--input', required=True, help="Input CSV file (file a)")
+    parser = argparse.ArgumentParser(description="Merge samples in a CSV file based on grouping information "
+                                                 "(mean, sum, median, SD and/or prevalence per group).",
+                                     epilog="Example: python script.py -i contig_abundance.csv -g Sample_Group.csv -c Group Time -o group_abundance.csv "
+                                            "[-s mean,sd,prevalence] [--chunksize 200000] (-i/-o may also be sparse .npz matrices from 110 -s)")
+    parser.add_argument('-i', '--input', required=True, help="Input CSV file (file a) or sparse .npz matrix")
     parser.add_argument('-g', '--grouping', required=True, help="Grouping CSV file (file b)")
     parser.add_argument('-c', '--columns', required=True, nargs='+', help="Columns in grouping file to use for grouping")
-    parser.add_argument('-o', '--output', required=True, help="Output CSV file")
+    parser.add_argument('-o', '--output', required=True, help="Output CSV file (or sparse .npz matrix)")
+    parser.add_argument('-s', '--stats', default='mean',
+                        help=f"Comma-separated statistics per group, from {','.join(STATS)} (default: mean). "
+                             "With several, output columns are named <group>_<stat>")
+    parser.add_argument('--chunksize', type=int, default=None,
+                        help="Process the input in blocks of this many rows, for matrices bigger than memory (default: whole file)")
     args = parser.parse_args()
 
-    # 2. Read input files
-    df_a = pd.read_csv(args.input, index_col='Contig_ID')
+    stats = [stat.strip() for stat in args.stats.split(',') if stat.strip()]
+    unknown = [stat for stat in stats if stat not in STATS]
+    if unknown:
+        parser.error(f"unknown statistic(s): {', '.join(unknown)}")
+
+    # 2. Read the grouping file
     df_b = pd.read_csv(args.grouping, index_col='Sample')
 
-    # 3. Create grouping dictionary and ordered groups
+    # 3. Create grouping labels and ordered groups; a repeated sample keeps its last label
     grouping = df_b[args.columns].apply(lambda x: '_'.join(x.astype(str)), axis=1)
-    group_dict = grouping.to_dict()
+    grouping = grouping[~grouping.index.duplicated(keep='last')]
     ordered_groups = grouping.drop_duplicates().tolist()
+    num_groups = len(ordered_groups)
+    columns = result_columns(ordered_groups, stats)
 
-    # 4. Group and average samples
-    new_data = []
-
-    for group in tqdm(ordered_groups, desc="Processing groups"):
-        samples = [sample for sample, g in group_dict.items() if g == group]
-        if samples:
-            new_data.append(df_a[samples].mean(axis=1))
+    # 4. Compute all statistics of all groups in one pass over each block of rows
+    if is_sparse_file(args.input):
+        # Memory-mapped sparse matrix: only the non-zero values are read
+        matrix = read_sparse(args.input)
+        column_groups = group_columns(matrix.samples, grouping, ordered_groups)
+        result = stack_stats(sparse_group_stats(matrix, column_groups, num_groups, stats, args.chunksize), stats, num_groups)
+        index = pd.Index(matrix.contigs, name='Contig_ID')
+    elif args.chunksize:
+        # Chunked mode: stream blocks of rows and write each block's statistics as soon as it is done
+        header = pd.read_csv(args.input, index_col='Contig_ID', nrows=0).columns
+        column_groups = group_columns(header, grouping, ordered_groups)
+        wanted = ['Contig_ID'] + [sample for sample, group in zip(header, column_groups) if group >= 0]
+        column_groups = column_groups[column_groups >= 0]
+        reader = pd.read_csv(args.input, index_col='Contig_ID', usecols=wanted, chunksize=args.chunksize)
+        blocks = (pd.DataFrame(stack_stats(group_stats(chunk.to_numpy(np.float64), column_groups, num_groups, stats), stats, num_groups),
+                               index=chunk.index, columns=columns)
+                  for chunk in tqdm(reader, desc="Processing chunks", unit='chunk'))
+        if is_sparse_file(args.output):
+            # Keep only the non-zero values of each block
+            contigs, indptrs, indices, data = [], [np.zeros(1, dtype=np.int64)], [], []
+            for block in blocks:
+                block_indptr, block_indices, block_data = csr_from_dense(block.to_numpy())
+                contigs.extend(block.index)
+                indptrs.append(block_indptr[1:] + indptrs[-1][-1])
+                indices.append(block_indices)
+                data.append(block_data)
+            write_sparse(args.output, contigs, columns, np.concatenate(indptrs),
+                         np.concatenate(indices or [np.zeros(0, dtype=np.int32)]), np.concatenate(data or [np.zeros(0, dtype=np.float32)]))
+        else:
+            with open(args.output, 'w', newline='') as out:
+                for i, block in enumerate(blocks):
+                    block.to_csv(out, header=(i == 0))
+        print(f"Grouped data saved to {args.output}")
+        return
+    else:
+        df_a = pd.read_csv(args.input, index_col='Contig_ID')
+        column_groups = group_columns(df_a.columns, grouping, ordered_groups)
+        result = stack_stats(group_stats(df_a.to_numpy(np.float64), column_groups, num_groups, stats), stats, num_groups)
+        index = df_a.index
 
     # 5. Create and save the new dataframe
-    df_result = pd.DataFrame(np.column_stack(new_data), index=df_a.index, columns=ordered_groups)
-    df_result.to_csv(args.output)
+    if is_sparse_file(args.output):
+        write_sparse(args.output, index, columns, *csr_from_dense(result))
+    else:
+        df_result = pd.DataFrame(result, index=index, columns=columns)
+        df_result.to_csv(args.output)
 
-    print(f"Grouped and averaged data saved to {args.output}")
+    print(f"Grouped data saved to {args.output}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,182 @@
+"""
+Sparse on-disk format for contig x sample abundance matrices.
+
+Most contigs are found in only a few samples, so the matrix is stored in CSR form
+(rows = contigs, columns = samples) in an uncompressed .npz archive:
+
+    indptr   int64[n_contigs + 1]   row start offsets into indices/data
+    indices  int32[nnz]             sample (column) of each stored value
+    data     float32[nnz]           non-zero abundances
+    contigs  uint8[...]             contig IDs, UTF-8, joined by newlines
+    samples  str[n_samples]         sample names
+    shape    int64[2]
+
+The members are stored without compression, so read_sparse memory-maps them
+straight out of the archive: opening a matrix costs a few page faults, not a parse.
+The archive is also readable with plain numpy.load (or scipy/R via the arrays).
+
+Used by 110_merge_abundance_into_single.py (writer), 021_reorder_sample_name.py
+and 305_merge_abundance_by_group.py (readers).
+"""
+import zipfile
+
+import numpy as np
+
+FORMAT_VERSION = 1
+
+def csr_from_coo(rows, cols, values, shape):
+    """Build CSR arrays from (row, column, value) triplets, dropping zeros; keeps column order within rows."""
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int32)
+    values = np.asarray(values, dtype=np.float32)
+    keep = values != 0
+    rows, cols, values = rows[keep], cols[keep], values[keep]
+    order = np.lexsort((cols, rows))
+    indptr = np.zeros(shape[0] + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=shape[0]), out=indptr[1:])
+    return indptr, cols[order], values[order]
+
+def csr_from_dense(matrix):
+    """CSR arrays of a dense 2-D array."""
+    rows, cols = np.nonzero(matrix)
+    return csr_from_coo(rows, cols, matrix[rows, cols], matrix.shape)
+
+def write_sparse(path, contigs, samples, indptr, indices, data):
+    """Write a CSR abundance matrix to an uncompressed .npz file."""
+    contigs = [str(contig) for contig in contigs]
+    np.savez(path,
+             indptr=np.asarray(indptr, dtype=np.int64),
+             indices=np.asarray(indices, dtype=np.int32),
+             data=np.asarray(data, dtype=np.float32),
+             contigs=np.frombuffer('\n'.join(contigs).encode(), dtype=np.uint8),
+             samples=np.array([str(sample) for sample in samples]),
+             shape=np.array([len(contigs), len(samples)], dtype=np.int64),
+             version=np.array([FORMAT_VERSION]))
+
+def _mmap_member(path, archive, name):
+    """Memory-map one stored (uncompressed) .npy member of a .npz archive; None if not possible."""
+    info = archive.getinfo(name + '.npy')
+    if info.compress_type != zipfile.ZIP_STORED:
+        return None
+    with open(path, 'rb') as f:
+        # Local file header: 30 bytes, then the file name and extra field
+        f.seek(info.header_offset + 26)
+        name_length, extra_length = np.frombuffer(f.read(4), dtype='<u2')
+        f.seek(info.header_offset + 30 + int(name_length) + int(extra_length))
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+    if dtype.hasobject:
+        return None
+    if int(np.prod(shape)) == 0:
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape, order='F' if fortran else 'C')
+
+class SparseAbundance:
+    """
+    CSR contig x sample abundance matrix, usually memory-mapped from a .npz file.
+
+    Attributes:
+        indptr, indices, data (ndarray): CSR arrays
+        samples (ndarray): Sample names (columns)
+        shape (tuple): (n_contigs, n_samples)
+    """
+    def __init__(self, indptr, indices, data, contig_blob, samples):
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self._contig_blob = contig_blob
+        self._contigs = None
+        self.samples = np.asarray(samples)
+        self.shape = (len(indptr) - 1, len(self.samples))
+
+    @property
+    def contigs(self):
+        """Contig IDs (rows), decoded on first use."""
+        if self._contigs is None:
+            text = np.asarray(self._contig_blob).tobytes().decode()
+            self._contigs = np.array(text.split('\n') if self.shape[0] else [], dtype=object)
+        return self._contigs
+
+    @property
+    def nnz(self):
+        return len(self.data)
+
+    def row_ids(self):
+        """Row (contig) number of every stored value."""
+        return np.repeat(np.arange(self.shape[0], dtype=np.int64), np.diff(self.indptr))
+
+    def select(self, rows=None, columns=None):
+        """
+        New matrix with a subset of rows (bool mask or indices) and/or columns in a new order.
+
+        Only the stored values are touched; the matrix is never densified.
+        """
+        row_ids = self.row_ids()
+        indices = np.asarray(self.indices)
+        data = np.asarray(self.data)
+        keep = np.ones(len(data), dtype=bool)
+        contigs = self.contigs
+        samples = self.samples
+        new_rows = np.arange(self.shape[0])
+        if rows is not None:
+            rows = np.flatnonzero(rows) if np.asarray(rows).dtype == bool else np.asarray(rows, dtype=np.int64)
+            new_rows = np.full(self.shape[0], -1, dtype=np.int64)
+            new_rows[rows] = np.arange(len(rows))
+            keep &= new_rows[row_ids] >= 0
+            contigs = contigs[rows]
+        new_columns = np.arange(self.shape[1])
+        if columns is not None:
+            columns = np.asarray(columns, dtype=np.int64)
+            new_columns = np.full(self.shape[1], -1, dtype=np.int64)
+            new_columns[columns] = np.arange(len(columns))
+            keep &= new_columns[indices] >= 0
+            samples = samples[columns]
+        indptr, indices, data = csr_from_coo(new_rows[row_ids[keep]], new_columns[indices[keep]], data[keep],
+                                             (len(contigs), len(samples)))
+        blob = np.frombuffer('\n'.join(contigs).encode(), dtype=np.uint8)
+        return SparseAbundance(indptr, indices, data, blob, samples)
+
+    def to_dense(self, start=0, stop=None, dtype=np.float32):
+        """Dense array of rows start:stop (all rows by default)."""
+        stop = self.shape[0] if stop is None else min(stop, self.shape[0])
+        lo, hi = int(self.indptr[start]), int(self.indptr[stop])
+        dense = np.zeros((stop - start, self.shape[1]), dtype=dtype)
+        counts = np.diff(np.asarray(self.indptr[start:stop + 1]))
+        dense[np.repeat(np.arange(stop - start), counts), self.indices[lo:hi]] = self.data[lo:hi]
+        return dense
+
+    def to_scipy(self):
+        """scipy.sparse.csr_matrix view of the matrix (needs scipy)."""
+        from scipy.sparse import csr_matrix
+        return csr_matrix((self.data, self.indices, self.indptr), shape=self.shape)
+
+    def write(self, path):
+        write_sparse(path, self.contigs, self.samples, self.indptr, self.indices, self.data)
+
+def read_sparse(path, mmap=True):
+    """
+    Open a sparse abundance matrix written by write_sparse.
+
+    With mmap=True the arrays are memory-mapped from the archive, so opening is
+    near-instant and only the parts used are read from disk.
+    """
+    with zipfile.ZipFile(path) as archive:
+        arrays = {}
+        for name in ('indptr', 'indices', 'data', 'contigs'):
+            arrays[name] = _mmap_member(path, archive, name) if mmap else None
+    if any(array is None for array in arrays.values()) or not mmap:
+        with np.load(path) as npz:
+            arrays = {name: npz[name] if arrays.get(name) is None else arrays[name]
+                      for name in ('indptr', 'indices', 'data', 'contigs')}
+            samples = npz['samples']
+    else:
+        with np.load(path) as npz:
+            samples = npz['samples']
+    return SparseAbundance(arrays['indptr'], arrays['indices'], arrays['data'], arrays['contigs'], samples)
+
+def is_sparse_file(path):
+    return str(path).endswith('.npz')
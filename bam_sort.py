@@ -0,0 +1,113 @@
+"""
+Concurrent samtools sort under a global memory and thread budget.
+
+samtools sort holds up to -m bytes per thread (-@) in memory before spilling to
+temporary files, so N concurrent sorts use about N * threads * m. plan_sort_jobs
+splits the budget between the jobs, and sort_bam writes its temporary files to a
+chosen scratch directory. Coordinate-sorted output is indexed during the sort
+(--write-index), so no second read for samtools index is needed.
+
+Used by 105_bam_sort_by_coordinate.py and 105_bam_sort_by_reads_name.py.
+"""
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from tqdm import tqdm
+from memory_size import parse_memory
+from job_ledger import JobLedger, atomic_outputs
+
+# Share of the budget given to sort buffers; the rest covers samtools' own overhead
+SORT_MEMORY_FRACTION = 0.8
+# Smallest useful -m; below this samtools spills tiny temporary files
+MIN_THREAD_MEMORY = 256 * 1024 ** 2
+# Threads per sort beyond which samtools gains little
+THREADS_PER_JOB = 4
+
+def plan_sort_jobs(num_files, memory, threads, jobs=None):
+    """
+    Split a memory and thread budget between concurrent sorts.
+
+    Args:
+        num_files (int): Number of BAM files to sort
+        memory (str|int): Total memory for all sorts, e.g. '32G'
+        threads (int): Total threads for all sorts
+        jobs (int): Concurrent sorts (default: one per THREADS_PER_JOB threads)
+
+    Returns:
+        tuple: (jobs, threads per job, '-m' value per thread in MiB, e.g. '800M')
+    """
+    budget = parse_memory(memory) * SORT_MEMORY_FRACTION
+    jobs = max(1, min(num_files, jobs or threads // THREADS_PER_JOB))
+    threads_per_job = max(1, threads // jobs)
+    # Fewer, larger jobs when the budget cannot give every thread a useful buffer
+    while budget / (jobs * threads_per_job) < MIN_THREAD_MEMORY and jobs * threads_per_job > 1:
+        if jobs > 1:
+            jobs -= 1
+            threads_per_job = max(1, threads // jobs)
+        else:
+            threads_per_job -= 1
+    thread_memory = max(1, int(budget / (jobs * threads_per_job)) // 1024 ** 2)
+    return jobs, threads_per_job, f'{thread_memory}M'
+
+def sort_bam(input_file, output_file, threads, thread_memory, by_name=False, temp_dir=None):
+    """
+    Sort one BAM with samtools, indexing coordinate-sorted output in the same pass.
+
+    Temporary files go to temp_dir (default: the output directory).
+    """
+    output_file = str(output_file)
+    temp_prefix = os.path.join(str(temp_dir or os.path.dirname(output_file) or '.'), f'{Path(output_file).stem}.tmp')
+    cmd = ['samtools', 'sort', '-@', str(threads), '-m', thread_memory, '-T', temp_prefix]
+    if by_name:
+        cmd += ['-n', '-o', output_file]
+    else:
+        cmd += ['--write-index', '-o', f'{output_file}##idx##{output_file}.bai']
+    subprocess.run(cmd + [str(input_file)], check=True)
+
+def run_sort_jobs(bam_files, output_dir, memory, threads, jobs=None, by_name=False, temp_dir=None, force=False):
+    """
+    Sort BAM files concurrently into output_dir as '<stem>_sort.bam'.
+
+    Outputs are renamed into place when complete; BAMs already sorted from unchanged
+    inputs (see job_ledger) are skipped unless force is set.
+
+    Returns:
+        tuple: (successful, failed) counts
+    """
+    output_dir = Path(output_dir)
+    ledger = JobLedger(output_dir, force)
+    if temp_dir:
+        Path(temp_dir).mkdir(parents=True, exist_ok=True)
+    # Largest files first, so the longest sorts do not start last
+    bam_files = sorted(bam_files, key=lambda f: os.path.getsize(f), reverse=True)
+    jobs, threads_per_job, thread_memory = plan_sort_jobs(len(bam_files), memory, threads, jobs)
+    print(f'Sorting {jobs} BAM file(s) at a time with {threads_per_job} threads and -m {thread_memory} each')
+
+    def sort_one(bam_file):
+        output_file = output_dir / (Path(bam_file).stem + '_sort.bam')
+        outputs = [output_file] if by_name else [output_file, Path(f'{output_file}.bai')]
+        params = {'by_name': by_name}
+        if ledger.is_done(outputs, [bam_file], params):
+            print(f'Skipping {Path(bam_file).name}, output is up to date.')
+            return True
+        try:
+            with atomic_outputs(*outputs) as temps:
+                sort_bam(bam_file, temps if by_name else temps[0], threads_per_job, thread_memory, by_name, temp_dir)
+            ledger.record(outputs, [bam_file], params)
+            print(f'Sorted {bam_file} to {output_file}')
+            return True
+        except subprocess.CalledProcessError as e:
+            print(f"Error processing {bam_file}: {e}")
+            return False
+
+    successful = failed = 0
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(sort_one, bam_file) for bam_file in bam_files]
+        for future in tqdm(as_completed(futures), total=len(futures), desc='Sorting BAM files'):
+            if future.result():
+                successful += 1
+            else:
+                failed += 1
+    return successful, failed
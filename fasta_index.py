@@ -0,0 +1,342 @@
+"""
+Shared FASTA index and random-access sequence extraction.
+
+The index has the columns of a samtools faidx .fai (NAME, LENGTH, OFFSET,
+LINEBASES, LINEWIDTH) and is cached next to the FASTA file as <fasta>.fidx.
+It is not written to <fasta>.fai because it also lists zero-length records,
+which samtools leaves out; samtools' own index is never overwritten. A small
+<fasta>.fidx.key file records the FASTA size and mtime the index was built
+from, so a stale index is rebuilt automatically.
+
+Sequences are read from a memory map, so fetching a contig or a region costs
+O(bytes requested) instead of a scan of the whole file.
+
+Used by the FASTA splitters (010, 011) and 203_annotate_padloc_version2.sh.
+"""
+import argparse
+import mmap
+import os
+import sys
+
+import numpy as np
+from tqdm import tqdm
+
+# Bytes scanned per block while indexing
+BLOCK_SIZE = 256 * 1024 * 1024
+# Suffix of the cached index, kept apart from samtools' <fasta>.fai
+INDEX_SUFFIX = '.fidx'
+
+def _file_key(fasta_file):
+    stat = os.stat(fasta_file)
+    return f"{stat.st_size}\t{stat.st_mtime_ns}"
+
+def _scan_block(data, block_start, block_end, size):
+    """Return per-line start, width (bytes incl. newline), bases and header flag for whole lines in a block."""
+    newlines = np.flatnonzero(data[block_start:block_end] == 10) + block_start
+    line_ends = newlines + 1
+    if block_end == size and data[size - 1] != 10:
+        # The file end closes the last line
+        newlines = np.append(newlines, size)
+        line_ends = np.append(line_ends, size)
+    line_starts = np.concatenate(([block_start], line_ends[:-1]))
+    line_widths = line_ends - line_starts
+    line_bases = newlines - line_starts
+    # Do not count carriage returns as bases
+    has_cr = line_bases > 0
+    line_bases[has_cr] -= data[newlines[has_cr] - 1] == 13
+    is_header = (newlines > line_starts) & (data[line_starts] == 62)
+    return line_starts, line_widths, line_bases, is_header
+
+class FastaIndex:
+    """
+    Byte-offset index of a FASTA file.
+
+    Per record (numpy arrays): names, lengths (bases), offsets (first sequence
+    byte), line_bases, line_widths, starts (header byte) and ends (start of the
+    next record). Records whose lines are not all the same width are marked in
+    `regular`; they can still be fetched, but not cached.
+    """
+
+    def __init__(self, fasta_file, names, lengths, offsets, line_bases, line_widths,
+                 starts=None, regular=None):
+        self.fasta_file = fasta_file
+        self.names = names
+        self.lengths = lengths
+        self.offsets = offsets
+        self.line_bases = line_bases
+        self.line_widths = line_widths
+        self.size = os.path.getsize(fasta_file)
+        self._starts = starts
+        self.regular = np.ones(len(names), dtype=bool) if regular is None else regular
+        self._lookup = None
+        self._file = None
+        self._mm = None
+
+    def __len__(self):
+        return len(self.names)
+
+    # 1. Building, caching and loading
+
+    @classmethod
+    def build(cls, fasta_file):
+        """Scan a FASTA file block by block with vectorised newline searches."""
+        size = os.path.getsize(fasta_file)
+        empty = np.zeros(0, dtype=np.int64)
+        if size == 0:
+            return cls(fasta_file, [], empty, empty, empty, empty, empty)
+
+        # Per-record partial statistics, one array per block (the last record may continue in the next block)
+        fields = ('starts', 'offsets', 'bases', 'lines', 'first_bases', 'first_width', 'last_bases', 'last_width', 'bad')
+        parts = {field: [] for field in fields}
+        with open(fasta_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            data = np.frombuffer(mm, dtype=np.uint8)
+            block_start = 0
+            with tqdm(total=size, unit='B', unit_scale=True, desc=f"Indexing {os.path.basename(fasta_file)}") as pbar:
+                while block_start < size:
+                    # Blocks end on a line boundary so no line is split between blocks
+                    block_end = min(block_start + BLOCK_SIZE, size)
+                    if block_end < size:
+                        newline = mm.rfind(b'\n', block_start, block_end)
+                        block_end = newline + 1 if newline >= 0 else (mm.find(b'\n', block_end) + 1 or size)
+                    line_starts, line_widths, line_bases, is_header = _scan_block(data, block_start, block_end, size)
+
+                    # Group sequence lines by record; group 0 continues the record left open by the previous block
+                    group = np.cumsum(is_header)
+                    num_groups = group[-1] + 1
+                    seq = ~is_header
+                    g, bases, widths = group[seq], line_bases[seq], line_widths[seq]
+                    lines = np.bincount(g, minlength=num_groups)
+                    total = np.bincount(g, weights=bases, minlength=num_groups).astype(np.int64)
+                    has_lines = lines > 0
+                    first = np.searchsorted(g, np.arange(num_groups), 'left')
+                    last = np.searchsorted(g, np.arange(num_groups), 'right') - 1
+                    first_bases = np.where(has_lines, bases[np.minimum(first, len(g) - 1)] if len(g) else 0, 0)
+                    first_width = np.where(has_lines, widths[np.minimum(first, len(g) - 1)] if len(g) else 0, 0)
+                    last_bases = np.where(has_lines, bases[np.maximum(last, 0)] if len(g) else 0, 0)
+                    last_width = np.where(has_lines, widths[np.maximum(last, 0)] if len(g) else 0, 0)
+
+                    # Every line but the last of a record must match the record's first line
+                    ref_bases, ref_width = first_bases.copy(), first_width.copy()
+                    open_record = bool(parts['starts']) and parts['lines'][-1][-1] > 0
+                    if open_record:
+                        ref_bases[0] = parts['first_bases'][-1][-1]
+                        ref_width[0] = parts['first_width'][-1][-1]
+                    inner = np.ones(len(g), dtype=bool)
+                    if len(g):
+                        inner[last[has_lines]] = False
+                    mismatch = inner & ((bases != ref_bases[g]) | (widths != ref_width[g]))
+                    bad = np.bincount(g, weights=mismatch, minlength=num_groups) > 0
+
+                    # Merge group 0 into the open record
+                    if parts['starts'] and lines[0]:
+                        if open_record:
+                            parts['bad'][-1][-1] |= (parts['last_bases'][-1][-1] != parts['first_bases'][-1][-1]) or \
+                                                    (parts['last_width'][-1][-1] != parts['first_width'][-1][-1])
+                        else:
+                            parts['first_bases'][-1][-1] = first_bases[0]
+                            parts['first_width'][-1][-1] = first_width[0]
+                        parts['bad'][-1][-1] |= bad[0]
+                        parts['last_bases'][-1][-1] = last_bases[0]
+                        parts['last_width'][-1][-1] = last_width[0]
+                        parts['lines'][-1][-1] += lines[0]
+                        parts['bases'][-1][-1] += total[0]
+
+                    # New records starting in this block
+                    if num_groups > 1:
+                        header_starts = line_starts[is_header]
+                        parts['starts'].append(header_starts)
+                        parts['offsets'].append(header_starts + line_widths[is_header])
+                        for field, values in (('bases', total), ('lines', lines), ('first_bases', first_bases),
+                                              ('first_width', first_width), ('last_bases', last_bases),
+                                              ('last_width', last_width), ('bad', bad)):
+                            parts[field].append(values[1:].copy())
+                    pbar.update(block_end - block_start)
+                    block_start = block_end
+            del data
+
+            if not parts['starts']:
+                return cls(fasta_file, [], empty, empty, empty, empty, empty)
+            stats = {field: np.concatenate(values) for field, values in parts.items()}
+
+            # Record names: first word of each header line
+            names = [(mm[start + 1:offset].split(maxsplit=1) or [b''])[0].decode()
+                     for start, offset in zip(stats['starts'].tolist(), stats['offsets'].tolist())]
+
+        last_ok = (stats['lines'] == 0) | ((stats['last_bases'] > 0) & (stats['last_bases'] <= stats['first_bases']))
+        regular = ~stats['bad'] & last_ok
+        # A single line closed by the end of the file counts its missing newline, as in samtools
+        line_widths = np.where((stats['lines'] > 0) & (stats['first_width'] == stats['first_bases']),
+                               stats['first_bases'] + 1, stats['first_width'])
+        return cls(fasta_file, names, stats['bases'], stats['offsets'].astype(np.int64),
+                   stats['first_bases'].astype(np.int64), line_widths.astype(np.int64),
+                   stats['starts'].astype(np.int64), regular)
+
+    def write(self, fai_file=None):
+        """Write the index (<fasta>.fidx) plus the size/mtime key; returns False if records are irregular."""
+        if not self.regular.all():
+            return False
+        fai_file = fai_file or self.fasta_file + INDEX_SUFFIX
+        with open(fai_file, 'w') as out:
+            for row in zip(self.names, self.lengths.tolist(), self.offsets.tolist(),
+                           self.line_bases.tolist(), self.line_widths.tolist()):
+                out.write('\t'.join(map(str, row)) + '\n')
+        with open(fai_file + '.key', 'w') as out:
+            out.write(_file_key(self.fasta_file) + '\n')
+        return True
+
+    @classmethod
+    def read(cls, fasta_file, fai_file=None):
+        """Load a cached index (or any .fai file given as fai_file)."""
+        fai_file = fai_file or fasta_file + INDEX_SUFFIX
+        names, columns = [], [[], [], [], []]
+        with open(fai_file) as f:
+            for line in f:
+                fields = line.rstrip('\n').split('\t')
+                names.append(fields[0])
+                for column, value in zip(columns, fields[1:5]):
+                    column.append(int(value))
+        lengths, offsets, line_bases, line_widths = (np.array(c, dtype=np.int64) for c in columns)
+        return cls(fasta_file, names, lengths, offsets, line_bases, line_widths)
+
+    @classmethod
+    def load(cls, fasta_file, rebuild=False):
+        """Return the cached index if its size/mtime key matches the FASTA file, otherwise build (and cache) it."""
+        fai_file = fasta_file + INDEX_SUFFIX
+        if not rebuild and os.path.exists(fai_file) and os.path.exists(fai_file + '.key'):
+            with open(fai_file + '.key') as f:
+                if f.read().strip() == _file_key(fasta_file):
+                    return cls.read(fasta_file, fai_file)
+        index = cls.build(fasta_file)
+        try:
+            if not index.write(fai_file):
+                print(f"Warning: {fasta_file} has irregular line lengths; index not cached", file=sys.stderr)
+        except OSError as e:
+            print(f"Warning: could not cache index for {fasta_file}: {e}", file=sys.stderr)
+        return index
+
+    # 2. Record byte ranges (used by the splitters)
+
+    @property
+    def starts(self):
+        """Byte offset of each record's header line."""
+        if self._starts is None:
+            mm = self.mmap()
+            self._starts = np.array([mm.rfind(b'\n', 0, offset - 1) + 1 for offset in self.offsets.tolist()],
+                                    dtype=np.int64)
+        return self._starts
+
+    @property
+    def ends(self):
+        """Byte offset just past each record (start of the next record, or the file end)."""
+        return np.append(self.starts[1:], self.size).astype(np.int64)
+
+    # 3. Random access
+
+    def mmap(self):
+        if self._mm is None:
+            self._file = open(self.fasta_file, 'rb')
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mm
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._file.close()
+            self._mm = self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def record_id(self, name):
+        if self._lookup is None:
+            self._lookup = {n: i for i, n in enumerate(self.names)}
+        try:
+            return self._lookup[name]
+        except KeyError:
+            raise KeyError(f"Sequence '{name}' not found in {self.fasta_file}") from None
+
+    def record(self, name):
+        """Return the raw bytes of a whole record (header and sequence lines, as in the file)."""
+        i = self.record_id(name)
+        data = self.mmap()[self.starts[i]:self.ends[i]]
+        return data if data.endswith(b'\n') else data + b'\n'
+
+    def fetch(self, name, start=None, end=None):
+        """Return the sequence of a record, or of the 1-based inclusive region start..end."""
+        i = self.record_id(name)
+        length = int(self.lengths[i])
+        start = max(1, start or 1)
+        end = min(length, end or length)
+        if start > end:
+            return ''
+        mm = self.mmap()
+        bases, width, offset = int(self.line_bases[i]), int(self.line_widths[i]), int(self.offsets[i])
+        if not self.regular[i]:
+            # Irregular line widths: strip line breaks from the whole record
+            sequence = mm[offset:int(self.ends[i])].replace(b'\n', b'').replace(b'\r', b'')
+            return sequence[start - 1:end].decode()
+        first = offset + (start - 1) // bases * width + (start - 1) % bases
+        last = offset + (end - 1) // bases * width + (end - 1) % bases + 1
+        return mm[first:last].replace(b'\n', b'').replace(b'\r', b'').decode()
+
+def parse_region(region):
+    """Parse 'name', 'name:start' or 'name:start-end' (1-based, inclusive)."""
+    name, _, span = region.rpartition(':')
+    if not name or not span.replace(',', '').replace('-', '').isdigit():
+        return region, None, None
+    start, _, end = span.replace(',', '').partition('-')
+    return name, int(start), int(end) if end else None
+
+def extract(fasta_file, names=(), regions=(), output=None, width=60):
+    """
+    Write whole records (by name) and regions (name:start-end) to a FASTA file or stdout.
+
+    Whole records are copied byte for byte; regions are wrapped at `width` bases.
+    """
+    out = open(output, 'wb') if output else sys.stdout.buffer
+    try:
+        with FastaIndex.load(fasta_file) as index:
+            for name in names:
+                out.write(index.record(name))
+            for region in regions:
+                name, start, end = parse_region(region)
+                sequence = index.fetch(name, start, end).encode()
+                out.write(f">{region}\n".encode())
+                for i in range(0, len(sequence), width):
+                    out.write(sequence[i:i + width] + b'\n')
+    finally:
+        if output:
+            out.close()
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Build/cache a .fai-style index (<fasta>.fidx) for a FASTA file and extract sequences by ID or region '
+                    'without scanning the whole file.',
+        formatter_class=argparse.RawTextHelpFormatter,
+        epilog='Examples:\n'
+               '  %(prog)s -i contigs.fasta                            # build or refresh contigs.fasta.fidx\n'
+               '  %(prog)s -i contigs.fasta -n ids.txt -o subset.fasta # extract the contigs listed in ids.txt\n'
+               '  %(prog)s -i contigs.fasta -r contig_1:100-250        # print a region to stdout')
+    parser.add_argument('-i', '--input', required=True, help='Input FASTA file')
+    parser.add_argument('-n', '--ids', help='File with one sequence ID per line to extract')
+    parser.add_argument('-r', '--region', nargs='+', default=[], help='Regions to extract (name, name:start-end)')
+    parser.add_argument('-o', '--output', help='Output FASTA file (default: stdout)')
+    parser.add_argument('-w', '--width', type=int, default=60, help='Line width for region output (default: 60)')
+    parser.add_argument('--rebuild', action='store_true', help='Rebuild the index even if the cached one is current')
+    args = parser.parse_args()
+
+    if args.rebuild or not (args.ids or args.region):
+        index = FastaIndex.load(args.input, rebuild=args.rebuild)
+        print(f"Indexed {len(index)} sequences in {args.input}", file=sys.stderr)
+    if args.ids or args.region:
+        names = []
+        if args.ids:
+            with open(args.ids) as f:
+                names = [line.split()[0] for line in f if line.strip()]
+        extract(args.input, names, args.region, args.output, args.width)
+
+if __name__ == '__main__':
+    main()
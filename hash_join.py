@@ -0,0 +1,123 @@
+"""
+Multi-way and out-of-core joins for tab-separated tables.
+
+multi_merge attaches any number of auxiliary tables to a main table in memory.
+partitioned_merge does the same for tables that do not fit in memory: all tables
+are read in chunks (only the requested columns), spilled to disk in hash
+partitions keyed on the join column, and joined partition by partition.
+The merged rows are streamed to the output, so peak memory is bounded by the
+largest partition instead of the size of the inputs.
+
+Used by 003_merge_txt_keep_all_rows_with_select_h.py (outer join) and
+004_merge_txt_only_keep_intersection_with_select_row_h.py (inner join).
+"""
+import math
+import os
+import tempfile
+
+import pandas as pd
+from tqdm import tqdm
+from memory_size import parse_memory
+
+# In-memory size of a pandas string table relative to its size on disk (rough)
+MEMORY_OVERHEAD = 6
+
+def read_header(file):
+    """Return the column names of a tab-separated file."""
+    return pd.read_csv(file, sep='\t', nrows=0).columns
+
+def estimate_row_bytes(file, sample_size=1024 * 1024):
+    """Estimate the average line length of a file from its first megabyte."""
+    with open(file, 'rb') as f:
+        sample = f.read(sample_size)
+    return max(1, len(sample) // max(1, sample.count(b'\n')))
+
+def multi_merge(main_df, main_col, aux_tables):
+    """
+    Attach several auxiliary tables to a main table, one join per table.
+
+    Args:
+        main_df (DataFrame): Main table, containing main_col
+        main_col (str): Join column in the main table
+        aux_tables (list): (aux_df, aux_col, how, name) tuples; how is 'outer', 'inner' or 'left'
+
+    Returns:
+        DataFrame: Merged table keyed on main_col
+
+    Auxiliary keys are renamed to main_col, so rows only present in an auxiliary
+    table keep their key. With one auxiliary table, colliding column names get pandas'
+    '_x'/'_y' suffixes as before; with several, the auxiliary copy gets '_<name>'.
+    """
+    merged_df = main_df
+    for aux_df, aux_col, how, name in aux_tables:
+        if aux_col != main_col:
+            aux_df = aux_df.rename(columns={aux_col: main_col})
+        suffixes = ('_x', '_y') if len(aux_tables) == 1 else ('', f'_{name}')
+        merged_df = pd.merge(merged_df, aux_df, on=main_col, how=how, suffixes=suffixes)
+    return merged_df
+
+def _spill(file, columns, key, num_partitions, rows_per_chunk, temp_dir, side):
+    """Read the selected columns of a file in chunks and append each row to its hash partition."""
+    paths = [os.path.join(temp_dir, f'{side}_{i}.tsv') for i in range(num_partitions)]
+    handles = [open(path, 'w', newline='') for path in paths]
+    try:
+        reader = pd.read_csv(file, sep='\t', usecols=list(dict.fromkeys(columns)), dtype=str,
+                             keep_default_na=False, chunksize=rows_per_chunk)
+        for chunk in tqdm(reader, desc=f"Partitioning {os.path.basename(file)}", unit='chunk'):
+            chunk = chunk[columns]
+            partition = pd.util.hash_pandas_object(chunk[key], index=False).to_numpy() % num_partitions
+            for i, part in chunk.groupby(partition, sort=False):
+                part.to_csv(handles[i], sep='\t', index=False, header=False)
+    finally:
+        for handle in handles:
+            handle.close()
+    return paths
+
+def _read_partition(path, columns):
+    return pd.read_csv(path, sep='\t', header=None, names=columns, dtype=str, keep_default_na=False)
+
+def partitioned_merge(main_file, main_columns, main_col, aux_specs, output_file, memory='2G', temp_dir=None):
+    """
+    Join tab-separated files on disk-backed hash partitions and stream the result.
+
+    Args:
+        main_file (str): Path to the main file
+        main_columns (list): Columns to keep from the main file (join column first)
+        main_col (str): Join column in the main file
+        aux_specs (list): (aux_file, aux_columns, aux_col, how, name) tuples, one per auxiliary file
+        output_file (str): Path to the tab-separated output file
+        memory (str|int): Memory budget, e.g. '4G'
+        temp_dir (str): Directory for partition files (default: system temp dir)
+
+    Returns:
+        int: Number of rows written
+
+    Values are kept as text, so numbers are written back exactly as they were read.
+    Rows are grouped by partition, not in the input order.
+    """
+    # 1. Size the partitions and read chunks so one partition fits the memory budget
+    budget = parse_memory(memory)
+    tables = [(main_file, main_columns, main_col)] + [(spec[0], spec[1], spec[2]) for spec in aux_specs]
+    selected_bytes = sum(os.path.getsize(file) * len(set(columns)) / len(read_header(file))
+                         for file, columns, _ in tables)
+    num_partitions = max(1, math.ceil(selected_bytes * MEMORY_OVERHEAD / budget))
+    rows_per_chunk = max(1000, budget // (MEMORY_OVERHEAD * 4 * estimate_row_bytes(main_file)))
+
+    rows_written = 0
+    with tempfile.TemporaryDirectory(prefix='hash_join_', dir=temp_dir) as work_dir:
+        # 2. Spill every table into hash partitions by join key
+        parts = [_spill(file, columns, key, num_partitions, rows_per_chunk, work_dir, f'table{t}')
+                 for t, (file, columns, key) in enumerate(tables)]
+
+        # 3. Join partition by partition and stream the output
+        with open(output_file, 'w', newline='') as out:
+            for i in tqdm(range(num_partitions), desc="Joining partitions"):
+                main_df = _read_partition(parts[0][i], main_columns)
+                aux_tables = [(_read_partition(paths[i], aux_columns), aux_col, how, name)
+                              for paths, (_, aux_columns, aux_col, how, name) in zip(parts[1:], aux_specs)]
+                merged_df = multi_merge(main_df, main_col, aux_tables)
+                merged_df.to_csv(out, sep='\t', index=False, header=(i == 0))
+                rows_written += len(merged_df)
+                for paths in parts:
+                    os.remove(paths[i])
+    return rows_written
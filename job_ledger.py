@@ -0,0 +1,133 @@
+"""
+Resume support for the per-sample BAM stages (104-108).
+
+Outputs are written to a hidden '.partial' folder in their final directory and
+renamed into place only when the step succeeds, so a killed job never leaves a file that
+looks finished. Each output directory keeps a manifest (.job_ledger.json) that
+records, per job, the size and mtime of its inputs, its parameters and the sizes
+of its outputs. A job is skipped only if all of these are unchanged.
+
+Used by 104_sam_to_bam.py, 105_bam_sort_by_*.py (through bam_sort.py),
+106_bam_filter.py, 107_calculate_abundance_*.py, 108_calculate_coverage*.py,
+104_108_quantify_samples.py, 109_calculate_abundance_per_sample.py (matrix mode) and
+110_merge_abundance_into_single.py.
+"""
+import json
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+LEDGER_NAME = '.job_ledger.json'
+
+def partial_path(path):
+    """
+    Temporary name of an output: same name in a hidden '.partial' folder next to it.
+
+    The folder is on the same filesystem (so the final rename is atomic), the
+    extension is kept for tools that pick the format from it, and directory globs
+    of the next step do not see unfinished files. An empty placeholder is created
+    at once, so a parallel job never removes the folder while this one still needs it.
+    """
+    temp = Path(path).parent / '.partial' / Path(path).name
+    while True:
+        try:
+            temp.parent.mkdir(exist_ok=True)
+            temp.touch()
+            return temp
+        except (FileExistsError, FileNotFoundError):
+            if temp.parent.exists() and not temp.parent.is_dir():
+                raise
+            # The folder was removed by another job in between; create it again
+            continue
+
+@contextmanager
+def atomic_outputs(*paths):
+    """
+    Yield temporary paths for the given outputs and rename them into place on success.
+
+    On an exception the temporary files are removed and the final paths are left untouched.
+    The '.partial' folders are removed again once empty.
+    """
+    temps = [partial_path(path) for path in paths]
+    try:
+        yield temps[0] if len(temps) == 1 else temps
+    except BaseException:
+        for temp in temps:
+            if temp.exists():
+                temp.unlink()
+        remove_partial_dirs(temps)
+        raise
+    for temp, path in zip(temps, paths):
+        os.replace(temp, path)
+    remove_partial_dirs(temps)
+
+def remove_partial_dirs(temps):
+    """Remove the '.partial' folders of the given temporary paths if empty (another job may still be using them)."""
+    for folder in {temp.parent for temp in temps}:
+        try:
+            os.rmdir(folder)
+        except OSError:
+            pass
+
+def fingerprint(paths):
+    """Size and mtime (ns) of each input file, keyed by file name so reruns from another directory match."""
+    result = {}
+    for path in paths:
+        stat = os.stat(path)
+        result[Path(path).name] = [stat.st_size, stat.st_mtime_ns]
+    return result
+
+class JobLedger:
+    """
+    Manifest of finished jobs in one output directory.
+
+    Args:
+        output_dir (str): Directory holding the outputs and the manifest
+        force (bool): Ignore recorded jobs and redo everything
+    """
+    def __init__(self, output_dir, force=False):
+        self.path = Path(output_dir) / LEDGER_NAME
+        self.force = force
+        self.lock = threading.Lock()
+        self.jobs = {}
+        if self.path.exists():
+            try:
+                with open(self.path) as f:
+                    self.jobs = json.load(f)
+            except (OSError, ValueError):
+                print(f'Ignoring unreadable job ledger {self.path}')
+
+    @staticmethod
+    def _key(outputs):
+        return Path(outputs[0]).name
+
+    def is_done(self, outputs, inputs, params=None):
+        """True if the outputs exist unchanged and were made from the same inputs and parameters."""
+        if self.force:
+            return False
+        with self.lock:
+            job = self.jobs.get(self._key(outputs))
+        if job is None:
+            return False
+        try:
+            if job['inputs'] != fingerprint(inputs):
+                return False
+            if any(os.path.getsize(path) != job['outputs'].get(Path(path).name) for path in outputs):
+                return False
+        except OSError:
+            return False
+        return job['params'] == json.loads(json.dumps(params or {}, default=str))
+
+    def record(self, outputs, inputs, params=None):
+        """Record a finished job and save the manifest atomically."""
+        job = {
+            'inputs': fingerprint(inputs),
+            'params': json.loads(json.dumps(params or {}, default=str)),
+            'outputs': {Path(path).name: os.path.getsize(path) for path in outputs},
+        }
+        with self.lock:
+            self.jobs[self._key(outputs)] = job
+            with atomic_outputs(self.path) as temp:
+                with open(temp, 'w') as f:
+                    json.dump(self.jobs, f, indent=1, sort_keys=True)
@@ -0,0 +1,16 @@
+"""
+Memory sizes given on the command line ('512M', '4G', or bytes).
+
+Standard library only, so the BAM stages can import it without pandas.
+
+Used by hash_join.py (003, 004), bam_sort.py (105) and 103_bwa_mem_align.py.
+"""
+
+UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+def parse_memory(memory):
+    """Parse a memory size such as '512M', '4G' or a plain number of bytes."""
+    memory = str(memory).strip().upper().rstrip('B')
+    if memory and memory[-1] in UNITS:
+        return int(float(memory[:-1]) * UNITS[memory[-1]])
+    return int(memory)
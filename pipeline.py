@@ -0,0 +1,84 @@
+"""
+Run external tools connected by pipes, as `a | b | c` would, without a shell.
+
+Every stage is waited for and checked, so a failure anywhere in the pipe is
+reported (a shell pipeline only reports the exit status of its last command).
+
+Used by 103_bwa_mem_align.py and 104_108_quantify_samples.py.
+"""
+import os
+import signal
+import subprocess
+
+def run_pipeline(commands, outputs=(), stdout=None):
+    """
+    Run commands with each one's stdout piped into the next one's stdin.
+
+    Args:
+        commands (list): Argument lists, one per stage
+        outputs (list): Files written by the pipeline, removed if any stage fails
+        stdout (str): File receiving the last stage's stdout (default: inherited)
+
+    Raises:
+        CalledProcessError: For the first failed stage, preferring stages that failed on
+            their own over stages killed by SIGPIPE because a later stage died
+    """
+    processes = []
+    stdin = None
+    sink = open(stdout, 'wb') if stdout else None
+    try:
+        for i, cmd in enumerate(commands):
+            last = i == len(commands) - 1
+            process = subprocess.Popen([str(arg) for arg in cmd], stdin=stdin,
+                                       stdout=sink if last else subprocess.PIPE)
+            # Close our copy of the pipe so the upstream stage sees SIGPIPE if this one dies
+            if stdin is not None:
+                stdin.close()
+            stdin = process.stdout
+            processes.append(process)
+    finally:
+        # If a stage failed to start, unblock the stages already running
+        if stdin is not None:
+            stdin.close()
+        returncodes = [process.wait() for process in processes]
+        if sink is not None:
+            sink.close()
+        failures = [(cmd, code) for cmd, code in zip(commands, returncodes) if code != 0]
+        if len(processes) < len(commands) or failures:
+            _remove(outputs)
+
+    _raise_failures(failures)
+
+def run_parallel(commands, outputs=()):
+    """
+    Run independent commands at the same time, e.g. several readers of one file.
+
+    Args:
+        commands (list): Argument lists, one per command
+        outputs (list): Files written by the commands, removed if any command fails
+
+    Raises:
+        CalledProcessError: For the first command that failed
+    """
+    processes = []
+    try:
+        for cmd in commands:
+            processes.append(subprocess.Popen([str(arg) for arg in cmd]))
+    finally:
+        returncodes = [process.wait() for process in processes]
+        failures = [(cmd, code) for cmd, code in zip(commands, returncodes) if code != 0]
+        if len(processes) < len(commands) or failures:
+            _remove(outputs)
+    _raise_failures(failures)
+
+def _remove(paths):
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+def _raise_failures(failures):
+    for cmd, code in failures:
+        print(f"Pipeline stage failed with exit code {code}: {' '.join(map(str, cmd))}")
+    if failures:
+        cmd, code = next((f for f in failures if f[1] != -signal.SIGPIPE), failures[0])
+        raise subprocess.CalledProcessError(code, [str(arg) for arg in cmd])
@@ -0,0 +1,58 @@
+"""
+Registry of contig/sample ID patterns and vectorised sample-name extraction.
+
+Each pattern captures the ID field that holds the sample number; all digits of
+that field form the number, and the sample name is 'Sample_' + the number
+zero-padded to two digits:
+
+    18097D-<x>-S05...  ->  Sample_05   (third '-' field)
+    DP<x>-12...        ->  Sample_12   (second '-' field)
+
+Used by 020_rename_contig_to_sample_csv.py, 020_rename_contig_to_sample_txt.py
+and 023_add_group_info_to_contigs.py.
+"""
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# Regexes are tried in order; the first match wins. Add new ID formats here.
+SAMPLE_ID_PATTERNS = {
+    '18097D': r'^18097D[^-]*-[^-]*-([^-]*)',
+    'DP': r'^DP[^-]*-([^-]*)',
+}
+
+def extract_sample_names(ids, patterns=None):
+    """
+    Extract sample names from a Series of IDs with one regex pass per pattern.
+
+    Returns:
+        Series: Categorical sample names (NaN where no pattern matches or the field has no digits)
+    """
+    patterns = SAMPLE_ID_PATTERNS if patterns is None else patterns
+    ids = pd.Series(ids).astype('string').str.strip()
+    fields = pd.Series(pd.NA, index=ids.index, dtype='string')
+    for regex in patterns.values():
+        todo = fields.isna()
+        if not todo.any():
+            break
+        fields[todo] = ids[todo].str.extract(regex, expand=False)
+
+    # Keep the digits of the captured field, e.g. 'S05a' -> '05' -> 'Sample_05'
+    digits = fields.str.replace(r'\D', '', regex=True).replace('', pd.NA)
+    names = 'Sample_' + digits.str.replace(r'^0+(?=\d)', '', regex=True).str.zfill(2)
+    return names.astype('category')
+
+def _extract_chunk(ids):
+    return extract_sample_names(ids)
+
+def extract_sample_names_parallel(ids, jobs=1, chunk_size=1_000_000):
+    """Extract sample names, splitting large inputs into chunks processed on `jobs` cores."""
+    ids = pd.Series(ids)
+    if jobs <= 1 or len(ids) <= chunk_size:
+        return extract_sample_names(ids)
+    chunks = [ids.iloc[i:i + chunk_size] for i in range(0, len(ids), chunk_size)]
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        results = list(executor.map(_extract_chunk, chunks))
+    combined = union_categoricals([r.array for r in results], sort_categories=True)
+    return pd.Series(combined, index=ids.index)
@@ -0,0 +1,93 @@
+"""
+Fixture test for the units of 107_calculate_abundance_units.py.
+
+A tiny name-grouped BAM is profiled and compared with the profile
+'msamtools profile --multi=all' gives for it, worked out by hand from
+msamtools' definitions (no msamtools binary is needed):
+
+- count: inserts per contig; Unknown = unmapped inserts
+- ab: inserts / contig length; Unknown gets the mapped inserts' average ab
+- rel: ab / sum of ab including Unknown, so Unknown = unmapped / all inserts
+- fpkm/rpkm: ab * 1e9 / all inserts (reads), tpm: rel * 1e6
+"""
+import gzip
+import importlib.util
+import sys
+from pathlib import Path
+
+import pytest
+
+pysam = pytest.importorskip('pysam')
+
+REPO = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO))
+spec = importlib.util.spec_from_file_location('abundance_units', REPO / '107_calculate_abundance_units.py')
+abundance_units = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(abundance_units)
+
+HEADER = {'HD': {'VN': '1.6', 'SO': 'queryname'},
+          'SQ': [{'SN': 'c1', 'LN': 1000}, {'SN': 'c2', 'LN': 500}]}
+
+# (name, mate, contig); contig None = unmapped
+RECORDS = [
+    ('q1', 1, 'c1'),     # both mates on c1: one insert, two reads
+    ('q1', 2, 'c1'),
+    ('q2', 1, 'c2'),     # mate 2 unmapped: a mapped insert, one unmapped read
+    ('q2', 2, None),
+    ('q3', 1, None),     # unmapped insert
+    ('q3', 2, None),
+    ('q4', 1, 'c1'),     # multi-mapper, counted on both contigs; single read
+    ('q4', 1, 'c2'),
+]
+
+# Inserts: 3 mapped (q1, q2, q4) + 1 unmapped; reads: 4 mapped + 3 unmapped
+# ab: c1 = 2/1000, c2 = 2/500, Unknown = 1 * (0.002 + 0.004) / 3
+EXPECTED = {
+    'count': {'Unknown': 1, 'c1': 2, 'c2': 2},
+    'ab': {'Unknown': 0.002, 'c1': 0.002, 'c2': 0.004},
+    'rel': {'Unknown': 0.25, 'c1': 0.25, 'c2': 0.5},
+    'tpm': {'Unknown': 250000, 'c1': 250000, 'c2': 500000},
+    'fpkm': {'Unknown': 500000, 'c1': 500000, 'c2': 1000000},
+    'rpkm': {'Unknown': 750000, 'c1': 3e9 / 1000 / 7, 'c2': 2e9 / 500 / 7},
+}
+
+# Body of the 'rel' profile (msamtools' default unit), Unknown row first
+EXPECTED_REL_PROFILE = 'ID\tsample_sort_filter.bam\nUnknown\t0.25\nc1\t0.25\nc2\t0.5\n'
+
+def write_bam(path):
+    with pysam.AlignmentFile(str(path), 'wb', header=HEADER) as out:
+        for name, mate, contig in RECORDS:
+            read = pysam.AlignedSegment(out.header)
+            read.query_name = name
+            read.flag = 1 | (64 if mate == 1 else 128)
+            read.query_sequence = 'A' * 50
+            if contig is None:
+                read.flag |= 4
+                read.reference_id = -1
+            else:
+                read.reference_name = contig
+                read.reference_start = 100
+                read.cigarstring = '50M'
+                read.mapping_quality = 60
+            out.write(read)
+
+def read_profile(path):
+    with gzip.open(path, 'rt') as handle:
+        lines = handle.read().splitlines()
+    return {name: float(value) for name, value in (line.split('\t') for line in lines[11:])}
+
+def test_units_match_msamtools_definitions(tmp_path):
+    bam_file = tmp_path / 'sample_sort_filter.bam'
+    write_bam(bam_file)
+    _, output_files = abundance_units.profile_bam_file(bam_file, tmp_path, abundance_units.UNITS, threads=1)
+    for unit, output_file in zip(abundance_units.UNITS, output_files):
+        assert read_profile(output_file) == pytest.approx(EXPECTED[unit], rel=1e-5), unit
+
+def test_rel_profile_matches_msamtools_layout(tmp_path):
+    bam_file = tmp_path / 'sample_sort_filter.bam'
+    write_bam(bam_file)
+    _, (output_file,) = abundance_units.profile_bam_file(bam_file, tmp_path, ['rel'], threads=1)
+    with gzip.open(output_file, 'rt') as handle:
+        lines = handle.read().splitlines(keepends=True)
+    assert '# Mapped inserts: 3\n' in lines and '# Unmapped inserts: 1\n' in lines
+    assert ''.join(lines[10:]) == EXPECTED_REL_PROFILE
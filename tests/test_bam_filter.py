@@ -0,0 +1,94 @@
+"""
+Fixture test for the pysam engine of 106_bam_filter.py.
+
+A tiny name-grouped BAM is written with pysam and filtered as
+'msamtools filter -l 40 -p 95 -z 80 --besthit' would; the kept records are
+listed by hand from msamtools' rules:
+
+- identity = (aligned length - NM) / aligned length, aligned length over M/I/D/=/X
+- coverage = aligned query bases / read length including soft and hard clips
+- best hit per mate: the passing alignments with the most matching bases (ties all kept)
+"""
+import importlib.util
+import sys
+from pathlib import Path
+
+import pytest
+
+pysam = pytest.importorskip('pysam')
+
+REPO = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO))
+spec = importlib.util.spec_from_file_location('bam_filter', REPO / '106_bam_filter.py')
+bam_filter = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(bam_filter)
+
+HEADER = {'HD': {'VN': '1.6', 'SO': 'queryname'},
+          'SQ': [{'SN': 'c1', 'LN': 1000}, {'SN': 'c2', 'LN': 1000}]}
+
+# (name, mate, contig, cigar, NM, secondary); contig None = unmapped
+RECORDS = [
+    ('q1', 1, 'c1', '50M', 0, False),      # 50 matches, best of mate 1: kept
+    ('q1', 1, 'c2', '50M', 3, True),       # 94% identity: dropped
+    ('q1', 2, 'c1', '50M', 1, False),      # 49 matches, tie: kept
+    ('q1', 2, 'c2', '50M', 1, True),       # 49 matches, tie: kept
+    ('q2', 1, 'c1', '30M20S', 0, False),   # aligned length 30 < 40: dropped
+    ('q2', 2, 'c1', '44M6I', 6, False),    # 44/50 = 88% identity: dropped
+    ('q2', 2, 'c2', '48M2D2M', 2, True),   # 50/52 = 96.2% identity (D counted): kept
+    ('q3', 1, None, None, 0, False),       # unmapped: dropped
+    ('q3', 2, None, None, 0, False),
+    ('q4', 1, 'c1', '45M5H', 0, False),    # 45/50 = 90% of the read aligned: kept
+    ('q4', 2, 'c2', '35M15H', 0, False),   # aligned length 35 < 40: dropped
+]
+
+EXPECTED = [
+    ('q1', 1, 'c1', '50M'),
+    ('q1', 2, 'c1', '50M'),
+    ('q1', 2, 'c2', '50M'),
+    ('q2', 2, 'c2', '48M2D2M'),
+    ('q4', 1, 'c1', '45M5H'),
+]
+
+def write_bam(path):
+    with pysam.AlignmentFile(str(path), 'wb', header=HEADER) as out:
+        for name, mate, contig, cigar, nm, secondary in RECORDS:
+            read = pysam.AlignedSegment(out.header)
+            read.query_name = name
+            read.flag = 1 | (64 if mate == 1 else 128) | (256 if secondary else 0)
+            if contig is None:
+                read.flag |= 4
+                read.query_sequence = 'A' * 50
+                read.reference_id = -1
+            else:
+                read.reference_name = contig
+                read.reference_start = 100
+                read.cigarstring = cigar
+                read.query_sequence = 'A' * read.query_length
+                read.mapping_quality = 60
+                read.set_tag('NM', nm)
+            out.write(read)
+
+def kept_records(path):
+    with pysam.AlignmentFile(str(path), 'rb') as bam:
+        return [(r.query_name, 1 if r.is_read1 else 2, r.reference_name, r.cigarstring)
+                for r in bam.fetch(until_eof=True)]
+
+def test_alignment_stats_counts_indels_and_clips(tmp_path):
+    bam_file = tmp_path / 'in.bam'
+    write_bam(bam_file)
+    with pysam.AlignmentFile(str(bam_file), 'rb') as bam:
+        stats = {(r.query_name, r.reference_name, r.cigarstring): bam_filter.alignment_stats(r)
+                 for r in bam.fetch(until_eof=True) if not r.is_unmapped}
+    assert stats[('q2', 'c2', '48M2D2M')] == (52, 50, 100.0)
+    assert stats[('q2', 'c1', '44M6I')] == (50, 44, 100.0)
+    assert stats[('q2', 'c1', '30M20S')] == (30, 30, 60.0)
+    assert stats[('q4', 'c1', '45M5H')] == (45, 45, 90.0)
+
+def test_pysam_filter_keeps_best_hits_per_mate(tmp_path):
+    bam_file = tmp_path / 'in.bam'
+    output_file = tmp_path / 'out.bam'
+    write_bam(bam_file)
+    read_count, written = bam_filter.pysam_filter(bam_file, output_file, length=40, identity=95, coverage=80, threads=1)
+    assert read_count == len(RECORDS)
+    assert written == len(EXPECTED)
+    assert kept_records(output_file) == EXPECTED